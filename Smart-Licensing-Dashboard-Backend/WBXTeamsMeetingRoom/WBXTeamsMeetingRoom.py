@@ -18,7 +18,7 @@ or implied.
 """
 
 import json
-import requests
+import http_client
 import datetime as dt
 
 
@@ -133,11 +133,11 @@ class WBXTeamsMeetingRoom(object):
 
         spark_request = None
         if post_data:
-            spark_request = requests.post(url,
+            spark_request = http_client.post(url,
                                           data=post_data,
                                           headers=post_headers)
         elif post_json:
-            spark_request = requests.post(url, json=post_json, headers=post_headers)
+            spark_request = http_client.post(url, json=post_json, headers=post_headers)
         else:
             return [False, {"error_key": "No json or data payload"}]
 
@@ -150,7 +150,7 @@ class WBXTeamsMeetingRoom(object):
     def get_request(self, url, get_headers, post_data=None, post_json=None):
 
         spark_request = None
-        spark_request = requests.get(url, headers=get_headers)
+        spark_request = http_client.get(url, headers=get_headers)
 
         if spark_request.status_code == 200:
             return [True, spark_request]
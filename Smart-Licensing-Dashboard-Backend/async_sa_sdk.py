@@ -0,0 +1,190 @@
+"""
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.0 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+
+"""
+
+import asyncio
+import json
+import aiohttp
+from loguru import logger
+
+import http_client
+import sa_sdk
+from sa_sdk import SmartAccountSDK, LICENSE_PAGE_SIZE, MAX_CONCURRENT_REQUESTS
+
+__author__ = "Tim Taylor <timtayl@cisco.com>"
+__contributors__ = ["William Kurkian <wkurkian@cisco.com>"]
+__copyright__ = "Copyright (c) 2019 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.0"
+
+"""
+asyncio flavour of the SmartAccountSDK.  list_accounts, list_licenses and list_all_licenses return the same values as
+their SmartAccountSDK counterparts, but are coroutines, so the refreshes of many users can share one event loop
+instead of each holding an OS thread while it waits on CSSM.
+
+    async with AsyncSmartAccountSDK("apx.cisco.com", token) as smart_account:
+        request_successful, json_array = await smart_account.list_all_licenses()
+"""
+
+
+class AsyncSmartAccountSDK:
+    def __init__(self, host, token, page_size=LICENSE_PAGE_SIZE, max_workers=MAX_CONCURRENT_REQUESTS):
+
+        self.host = host
+        self.token = token
+        self.page_size = page_size
+        self.max_workers = max_workers
+        self.__all_licenses = None
+        self.__session = None
+        self.__request_slots = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def close(self):
+        if self.__session is not None:
+            await self.__session.close()
+            self.__session = None
+
+    def __client_session(self):
+        # created on first use so that the session and semaphore belong to the running event loop
+        if self.__session is None:
+            http_settings = http_client.settings()
+            connect_timeout, read_timeout = http_settings['timeout']
+            self.__session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=http_settings['pool_maxsize']),
+                timeout=aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout),
+                headers={"Content-Type": "application/json", "Authorization": "Bearer " + self.token})
+            self.__request_slots = asyncio.Semaphore(max(1, self.max_workers))
+        return self.__session
+
+    async def __request(self, method, call, body=None):
+        """ sends a request through the shared rate limiter, retrying 429/5xx responses and connection errors"""
+        uri = ("https://" + self.host + call)
+        session = self.__client_session()
+
+        attempt = 0
+        while True:
+            # the slot is held while the request is in flight only, not during the backoff
+            async with self.__request_slots:
+                await asyncio.sleep(sa_sdk.cssm_rate_limiter.reserve())
+                try:
+                    async with session.request(method, uri,
+                                               data=None if body is None else json.dumps(body)) as response:
+                        status_code = response.status
+                        if status_code == 200:
+                            return True, status_code, await response.json(content_type=None)
+
+                        if status_code not in sa_sdk.RETRY_STATUS_CODES or attempt >= sa_sdk.MAX_RETRIES:
+                            logger.info(" response not successful, response status code:  {}".format(status_code))
+                            logger.info(" response body:  \n{}".format(await response.text()))
+                            return False, status_code, None
+
+                        delay = sa_sdk.retry_delay(attempt, response.headers.get('Retry-After'))
+                        logger.warning('{} {} returned {}, retrying in {:.1f}s'.format(method, uri, status_code, delay))
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                    if attempt >= sa_sdk.MAX_RETRIES:
+                        raise
+                    delay = sa_sdk.retry_delay(attempt)
+                    logger.warning('{} {} failed with {!r}, retrying in {:.1f}s'.format(method, uri, e, delay))
+
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def list_accounts(self):
+        """ returns all accounts associated with a user"""
+        return await self.__request("GET", "/services/api/smart-accounts-and-licensing/v2/accounts/")
+
+    async def __license_page(self, sa_domain, virtual_accounts, offset, limit):
+        call = "/services/api/smart-accounts-and-licensing/v1/accounts/" + sa_domain + "/licenses"
+        body = {"limit": limit, "offset": offset, 'virtualAccounts': virtual_accounts}
+        return await self.__request("POST", call, body)
+
+    async def list_licenses(self, sa_domain, virtual_accounts, page_size=None):
+        """ returns all the licenses of a Smart Account.  Pages after the first are requested concurrently."""
+        limit = page_size or self.page_size
+
+        request_successful, status_code, response_json = await self.__license_page(sa_domain, virtual_accounts,
+                                                                                    0, limit)
+        if not request_successful:
+            return request_successful, status_code, None
+
+        response_json["licenses"] = list(response_json.get("licenses") or [])
+        total_records = response_json.get("totalRecords")
+        last_page_size = len(response_json["licenses"])
+
+        # totalRecords can be stale, i.e. licenses added while we page, so the pages are followed for as long as the
+        # last one comes back full
+        while last_page_size == limit:
+            offset = len(response_json["licenses"])
+            # without totalRecords, or past it, we can only walk one page at a time
+            if total_records is not None and offset < total_records:
+                offsets = range(offset, total_records, limit)
+            else:
+                offsets = [offset]
+            pages = await asyncio.gather(*[self.__license_page(sa_domain, virtual_accounts, the_offset, limit)
+                                           for the_offset in offsets])
+
+            for page_successful, status_code, page_json in pages:
+                if not page_successful:
+                    # a partial license list would look like a real one on the dashboard, so fail the whole request.
+                    return False, status_code, None
+                page_licenses = page_json.get("licenses") or []
+                response_json["licenses"].extend(page_licenses)
+                last_page_size = len(page_licenses)
+
+        return True, status_code, response_json
+
+    async def retrieve_account_licenses(self, sa):
+        """ retrieves the licenses of one Smart Account with a single domain wide request and attaches them to sa"""
+        request_successful, status_code, json_array = await self.list_licenses(sa.get("accountDomain"), [])
+
+        if request_successful:
+            SmartAccountSDK.attach_licenses(sa, json_array.get("licenses"))
+        else:
+            logger.error('Failure with list_licenses. status code: {}, domain: {}'.format(status_code,
+                                                                                          sa.get("accountDomain")))
+        return request_successful, status_code
+
+    async def list_all_licenses(self):
+
+        overall_request_successful = False
+        status_code = -999
+        if self.__all_licenses is None:
+
+            request_successful, status_code, the_accounts = await self.list_accounts()
+            logger.info('list accounts request_successful: {}\n'.format(request_successful))
+
+            if request_successful:
+                accounts = the_accounts.get("accounts")
+
+                # gather returns the results in account order, so the merged result is deterministic
+                results = await asyncio.gather(*[self.retrieve_account_licenses(sa) for sa in accounts])
+
+                for account_request_success, status_code in results:
+                    overall_request_successful = overall_request_successful or account_request_success
+
+                self.__all_licenses = accounts
+        else:
+            overall_request_successful = True
+
+        logger.info("request_successful: {}, status code: {}".format(overall_request_successful, status_code))
+
+        return overall_request_successful, self.__all_licenses
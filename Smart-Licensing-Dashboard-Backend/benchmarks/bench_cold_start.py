@@ -0,0 +1,143 @@
+"""
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.0 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+from bench_license_analytics import BACKEND_DIR, RESULTS_DIR, compare, git_revision
+from cssm_payload import generate_accounts
+
+__author__ = "Tim Taylor <timtayl@cisco.com>"
+__contributors__ = ["William Kurkian <wkurkian@cisco.com>"]
+__copyright__ = "Copyright (c) 2019 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.0"
+
+"""
+Times how long a freshly started worker takes to import the backend and the bot, and what the first request that needs
+the license analytics adds to that.
+
+    python benchmarks/bench_cold_start.py
+
+Every case runs in a new interpreter, so nothing is imported yet.  The time covers the code of the case only, not the
+start of the interpreter itself, and the best of --repeat runs is kept.  Next to the time, each case lists which of the
+heavy modules (pandas, numpy, aiohttp, ...) it ended up importing.  The results are appended to
+benchmarks/results/cold_start.json and compared with the previous run.
+"""
+
+WEBEX_TEAMS_DIR = os.path.join(os.path.dirname(BACKEND_DIR), 'WebexTeams')
+
+HEAVY_MODULES = ['pandas', 'numpy', 'pyarrow', 'aiohttp', 'requests_toolbelt', 'xlsxwriter', 'connexion', 'redis']
+
+# one virtual account with a couple of licenses, enough to go through the parser and a request once
+SMALL_PAYLOAD = generate_accounts(1, 1, 2, 1)
+
+# (name, directories on the python path, code to time)
+CASES = [('import CSSMJSONParser', [BACKEND_DIR],
+          'import CSSMJSONParser'),
+         ('first parse', [BACKEND_DIR],
+          'import CSSMJSONParser\n'
+          'CSSMJSONParser.CSSMJSONParser({}).cssm_license().cssm_license_shortage()'.format(SMALL_PAYLOAD)),
+         ('import slp_backend', [BACKEND_DIR],
+          'import slp_backend'),
+         ('import sld_pullbot_function', [WEBEX_TEAMS_DIR, BACKEND_DIR],
+          'import sld_pullbot_function'),
+         ('bot hello', [WEBEX_TEAMS_DIR, BACKEND_DIR],
+          'import sld_pullbot_function\nsld_pullbot_function.prepare_hello_message()')]
+
+RUNNER = '''
+import json, sys, time
+start = time.perf_counter()
+exec(compile({code!r}, '<cold start>', 'exec'))
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds, 'loaded': [m for m in {heavy!r} if m in sys.modules]}}))
+'''
+
+
+def run_case(path, code, cwd):
+    """ runs code in a new interpreter, returns ({'seconds': ..., 'loaded': [...]}, None) or (None, the error)"""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(path))
+    completed = subprocess.run([sys.executable, '-c', RUNNER.format(code=code, heavy=HEAVY_MODULES)], cwd=cwd,
+                               env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if completed.returncode != 0:
+        error = completed.stderr.decode('utf-8', 'replace').strip().splitlines()
+        return None, error[-1] if error else 'exit code {}'.format(completed.returncode)
+    return json.loads(completed.stdout.decode().strip().splitlines()[-1]), None
+
+
+def run_benchmarks(repeat):
+    results = {}
+    for name, path, code in CASES:
+        best = None
+        for _ in range(repeat):
+            result, error = run_case(path, code, path[0])
+            if error is not None:
+                # i.e. connexion is not installed where the benchmark runs
+                print('{:<30} failed: {}'.format(name, error))
+                break
+            if best is None or result['seconds'] < best['seconds']:
+                best = result
+        else:
+            results[name] = best
+            print('{:<30} {:>8.4f}s  loads {}'.format(name, best['seconds'], ', '.join(best['loaded']) or '-'))
+
+    return results
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description='Times the cold start of the backend and the bot.')
+    argument_parser.add_argument('--repeat', type=int, default=5)
+    argument_parser.add_argument('--threshold', type=float, default=1.25)
+    argument_parser.add_argument('--no-save', action='store_true', help="don't append the results to the history")
+    args = argument_parser.parse_args()
+
+    results = run_benchmarks(args.repeat)
+    run = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+           'revision': git_revision(),
+           'python': platform.python_version(),
+           'results': results}
+
+    results_file = os.path.join(RESULTS_DIR, 'cold_start.json')
+    history = []
+    if os.path.exists(results_file):
+        with open(results_file, 'r') as fp:
+            history = json.load(fp)
+
+    regressions = []
+    if history:
+        print('\ncompared with {} ({})'.format(history[-1]['revision'], history[-1]['time']))
+        regressions = compare(history[-1]['results'], results, args.threshold)
+
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        with open(results_file, 'w') as fp:
+            json.dump(history + [run], fp, indent=2)
+        print('\nresults saved to {}'.format(results_file))
+
+    if regressions:
+        print('regressions: {}'.format(', '.join(regressions)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.0 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+
+"""
+
+import argparse
+import contextlib
+import copy
+import datetime
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+import pandas as pd
+from loguru import logger
+
+import CSSMJSONParser as cssm_parser
+from CSSMLicense import CSSMLicense
+from cssm_payload import REFERENCE_DATE, generate_accounts
+
+__author__ = "Tim Taylor <timtayl@cisco.com>"
+__contributors__ = ["William Kurkian <wkurkian@cisco.com>"]
+__copyright__ = "Copyright (c) 2019 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.0"
+
+"""
+Times the parser and every CSSMLicense request on a synthetic CSSM payload and tracks their peak memory.
+
+    python benchmarks/bench_license_analytics.py --scale medium
+
+Each case is timed --repeat times and the best time is kept.  The peak memory is measured with tracemalloc in one extra
+run.  The results are appended to benchmarks/results/<scale>.json and compared with the previous run of the same scale.
+A case that got more than --threshold times slower is reported as a regression and makes the script exit with 1.
+"""
+
+# (accounts, virtual accounts per account, licenses per virtual account, details per license)
+SCALES = {'small': (3, 5, 10, 2),
+          'medium': (10, 20, 30, 3),
+          'large': (40, 40, 60, 3)}
+
+RESULTS_DIR = os.path.join(BENCHMARK_DIR, 'results')
+
+# regressions smaller than this are timer noise
+MIN_REGRESSION_SECONDS = 0.005
+
+
+def measure(function, repeat):
+    """ returns (best time in seconds, peak memory in bytes) of function()"""
+    best = None
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            function()
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            function()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return best, peak
+
+
+def license_queries(va_list, virtual_accounts):
+    """ (name, function of a CSSMLicense) for every request the dashboard and the bot make"""
+    return [('account_names', lambda cssm_license: cssm_license.account_names()),
+            ('cssm_virt_account_by_accountName', lambda cssm_license: cssm_license.cssm_virt_account_by_accountName()),
+            ('cssm_license_shortage', lambda cssm_license: cssm_license.cssm_license_shortage()),
+            ('cssm_license_top_five_shortage', lambda cssm_license: cssm_license.cssm_license_top_five_shortage()),
+            ('cssm_license_usage_dict', lambda cssm_license: cssm_license.cssm_license_usage_dict()),
+            ('cssm_top_license_usage_dict', lambda cssm_license: cssm_license.cssm_top_license_usage_dict()),
+            ('cssm_expired_licenses', lambda cssm_license: cssm_license.cssm_expired_licenses()),
+            ('cssm_top_five_expired_licenses',
+             lambda cssm_license: cssm_license.cssm_top_five_expired_licenses(virtual_accounts)),
+            ('cssm_future_expired_licenses', lambda cssm_license: cssm_license.cssm_future_expired_licenses(180)),
+            ('cssm_top_five_future_expired_licenses',
+             lambda cssm_license: cssm_license.cssm_top_five_future_expired_licenses(va_list, 180)),
+            ('cssm_top_license_technology_dict',
+             lambda cssm_license: cssm_license.cssm_top_license_technology_dict(va_list)),
+            ('cssm_top_license_customer_dict',
+             lambda cssm_license: cssm_license.cssm_top_license_customer_dict(va_list))]
+
+
+def run_benchmarks(json_array, repeat):
+    results = {}
+
+    def record(name, function):
+        seconds, peak_bytes = measure(function, repeat)
+        results[name] = {'seconds': seconds, 'peak_bytes': peak_bytes}
+        print('{:<45} {:>10.4f}s {:>10.1f} MiB'.format(name, seconds, peak_bytes / 2 ** 20))
+
+    # the parser, on a copy of the json so that every run starts from the same input
+    record('convert_json_to_dataframe',
+           lambda: cssm_parser.CSSMJSONParser(copy.deepcopy(json_array)).convert_json_to_dataframe())
+
+    parser = cssm_parser.CSSMJSONParser(copy.deepcopy(json_array))
+    df = parser.cssm_dataframe()
+    unique_df = parser.cssm_unique_dataframe()
+    full_account_rows = parser.cssm_full_account_rows()
+    parser.license_fingerprints()
+    results['rows'] = len(df)
+
+    changed_json = copy.deepcopy(json_array)
+    for account in changed_json[::4]:
+        account['roles'][1]['licenses'][0]['inUse'] += 1
+    record('refresh', lambda: parser.refresh(changed_json).cssm_dataframe())
+
+    record('cssm_license_chunks',
+           lambda: parser.cssm_license_chunks(expiration_days=180).cssm_license_shortage())
+
+    with tempfile.TemporaryDirectory() as snapshot_dir:
+        snapshot_path = os.path.join(snapshot_dir, 'snapshot.arrow')
+        record('save_snapshot', lambda: parser.save_snapshot(snapshot_path))
+        record('load_snapshot', lambda: cssm_parser.CSSMJSONParser.load_snapshot(snapshot_path).cssm_dataframe())
+
+    # every request on a fresh CSSMLicense, so its lazily cached results are not reused between runs.  It gets the
+    # parse time unique dataframe and fullAccount index, as it does from CSSMJSONParser.cssm_license()
+    full_accounts = sorted(set(df['accountName'].astype(str) + '_' + df['virtualAccount'].astype(str)))
+    va_list = full_accounts[::2]
+    virtual_accounts = [full_account.split('_', 1)[1] for full_account in va_list]
+    for name, query in license_queries(va_list, virtual_accounts):
+        record(name, lambda query=query: query(CSSMLicense(df, unique_df, full_account_rows)))
+
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(previous, current, threshold):
+    """ prints the change of every case against the previous run, returns the names of the regressions"""
+    regressions = []
+    for name, result in current.items():
+        if not isinstance(result, dict) or name not in previous:
+            continue
+        before, after = previous[name]['seconds'], result['seconds']
+        ratio = after / before if before > 0 else float('inf')
+        regressed = ratio > threshold and after - before > MIN_REGRESSION_SECONDS
+        if regressed:
+            regressions.append(name)
+        print('{:<45} {:>10.4f}s -> {:>8.4f}s  x{:.2f}{}'.format(name, before, after, ratio,
+                                                                 '  REGRESSION' if regressed else ''))
+    return regressions
+
+
+def parse_date(value):
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(
+        description='Times the CSSM parser and the CSSMLicense requests on a synthetic payload.')
+    argument_parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    argument_parser.add_argument('--accounts', type=int)
+    argument_parser.add_argument('--virtual-accounts', type=int)
+    argument_parser.add_argument('--licenses', type=int)
+    argument_parser.add_argument('--details', type=int)
+    argument_parser.add_argument('--seed', type=int, default=0)
+    argument_parser.add_argument('--reference-date', type=parse_date, default=REFERENCE_DATE,
+                                 help='day the license dates are spread around, YYYY-MM-DD (default: %(default)s)')
+    argument_parser.add_argument('--repeat', type=int, default=3)
+    argument_parser.add_argument('--threshold', type=float, default=1.25)
+    argument_parser.add_argument('--no-save', action='store_true', help="don't append the results to the history")
+    args = argument_parser.parse_args()
+
+    accounts, virtual_accounts, licenses, details = SCALES[args.scale]
+    scale = {'accounts': args.accounts or accounts,
+             'virtual_accounts': args.virtual_accounts or virtual_accounts,
+             'licenses': args.licenses or licenses,
+             'details': args.details or details,
+             'seed': args.seed,
+             'reference_date': args.reference_date.isoformat()}
+    label = args.scale
+    if (scale['accounts'], scale['virtual_accounts'], scale['licenses'], scale['details']) != SCALES[args.scale] or \
+            args.seed or args.reference_date != REFERENCE_DATE:
+        label = '{accounts}x{virtual_accounts}x{licenses}x{details}-{seed}-{reference_date}'.format(**scale)
+
+    # the requests log every call at DEBUG level, which would be timed as well
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+    # CSSMLicense reads the technology and customer catalogs relative to the working directory
+    os.chdir(BACKEND_DIR)
+
+    json_array = generate_accounts(scale['accounts'], scale['virtual_accounts'], scale['licenses'], scale['details'],
+                                   seed=scale['seed'], reference_date=args.reference_date)
+    print('scale {}: {}'.format(label, scale))
+    results = run_benchmarks(json_array, args.repeat)
+
+    run = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+           'revision': git_revision(),
+           'python': platform.python_version(),
+           'pandas': pd.__version__,
+           'scale': scale,
+           'results': results}
+
+    results_file = os.path.join(RESULTS_DIR, label + '.json')
+    history = []
+    if os.path.exists(results_file):
+        with open(results_file, 'r') as fp:
+            history = json.load(fp)
+
+    regressions = []
+    if history:
+        print('\ncompared with {} ({})'.format(history[-1]['revision'], history[-1]['time']))
+        regressions = compare(history[-1]['results'], results, args.threshold)
+
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        with open(results_file, 'w') as fp:
+            json.dump(history + [run], fp, indent=2)
+        print('\nresults saved to {}'.format(results_file))
+
+    if regressions:
+        print('regressions: {}'.format(', '.join(regressions)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.0 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+
+"""
+
+import json
+import os
+import random
+from datetime import date, timedelta
+
+__author__ = "Tim Taylor <timtayl@cisco.com>"
+__contributors__ = ["William Kurkian <wkurkian@cisco.com>"]
+__copyright__ = "Copyright (c) 2019 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.0"
+
+"""
+Synthetic CSSM payloads for the benchmarks.  generate_accounts() returns the same accounts/roles/licenses/licenseDetails
+json that SmartAccountSDK.list_all_licenses() does, at any scale, so the parser and CSSMLicense can be timed on more
+than the small test fixtures.
+
+License names come from the technology catalog and virtual account names partly from the customer list, so the
+technology and customer requests find matches.  Some licenses are short, some are expired or expire soon, and dates
+come in both formats CSSM uses.  The same seed and reference date always give the same payload, whatever day it is
+generated on.
+"""
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LICENSE_ROLES = ['Virtual Account Administrator', 'Virtual Account User']
+
+# The license dates are spread around this day.  Pinned, so a benchmark history compares runs on the same payload.
+REFERENCE_DATE = date(2020, 1, 1)
+
+
+def catalog_names(file_name):
+    with open(os.path.join(BACKEND_DIR, file_name), 'r') as fp:
+        return sorted(json.load(fp).keys())
+
+
+def cssm_date(the_date, the_random):
+    # CSSM sends both, i.e. '2019-01-18T01:07:36Z' and '2019-05-20'
+    if the_random.random() < 0.5:
+        return the_date.strftime('%Y-%m-%dT01:07:36Z')
+    return the_date.strftime('%Y-%m-%d')
+
+
+def generate_license_details(details, the_random, today):
+    license_details = []
+    for detail in range(details):
+        if the_random.random() < 0.1:
+            # perpetual licenses have no dates
+            start_date, end_date, license_type = None, None, 'PERPETUAL'
+        else:
+            start = today - timedelta(days=the_random.randint(30, 1500))
+            # about a third expired, a few expiring within the next months, the rest later
+            end = today + timedelta(days=the_random.randint(-400, 900))
+            start_date, end_date, license_type = cssm_date(start, the_random), cssm_date(end, the_random), 'TERM'
+
+        license_details.append({'startDate': start_date,
+                                'endDate': end_date,
+                                'subscriptionId': 'Sub{}'.format(the_random.randint(1, 999999))
+                                if the_random.random() < 0.6 else None,
+                                'status': 'ACTIVE',
+                                'licenseType': license_type,
+                                'quantity': the_random.randint(1, 500)})
+    return license_details
+
+
+def generate_accounts(accounts=5, virtual_accounts=10, licenses=20, details=2, seed=0, reference_date=REFERENCE_DATE):
+    """ returns accounts Smart Accounts with virtual_accounts virtual accounts each, licenses licenses per virtual
+    account and details licenseDetails per license.  The license dates are spread around reference_date, pass
+    date.today() to have some of them expire in the coming days."""
+    the_random = random.Random(seed)
+    today = reference_date
+    license_names = catalog_names('technology_json_v2') + ['Uncatalogued License {}'.format(i) for i in range(20)]
+    customer_names = catalog_names('customer_json')
+
+    the_accounts = []
+    for account in range(accounts):
+        account_name = 'Benchmark Account {}'.format(account)
+        roles = [{'role': 'Smart Account User'}]
+
+        for virtual_account in range(virtual_accounts):
+            if the_random.random() < 0.3:
+                va_name = '{} VA {}-{}'.format(the_random.choice(customer_names), account, virtual_account)
+            else:
+                va_name = 'VA {}-{}'.format(account, virtual_account)
+
+            va_licenses = []
+            for license_name in the_random.sample(license_names, min(licenses, len(license_names))):
+                quantity = the_random.randint(1, 2000)
+                # about one license in five is short
+                in_use = the_random.randint(0, quantity) if the_random.random() < 0.8 else \
+                    quantity + the_random.randint(1, 500)
+                va_licenses.append({'license': license_name,
+                                    'quantity': quantity,
+                                    'inUse': in_use,
+                                    'available': quantity - in_use,
+                                    'reserved': 0,
+                                    'pendingQuantity': 0,
+                                    'billingType': the_random.choice(['PREPAID', 'USAGE', 'SUBSCRIPTION']),
+                                    'isPortable': the_random.random() < 0.1,
+                                    'ahaApps': False,
+                                    'virtualAccount': va_name,
+                                    'status': 'In Compliance' if in_use <= quantity else 'Insufficient Licenses',
+                                    'licenseDetails': generate_license_details(details, the_random, today),
+                                    'licenseSubstitutions': []})
+
+            roles.append({'role': the_random.choice(LICENSE_ROLES),
+                          'virtualAccount': va_name,
+                          'licenses': va_licenses})
+
+        the_accounts.append({'accountName': account_name,
+                             'accountDomain': 'benchmark-{}.example.com'.format(account),
+                             'accountStatus': 'Active',
+                             'accountType': 'CUSTOMER',
+                             'roles': roles})
+
+    return the_accounts
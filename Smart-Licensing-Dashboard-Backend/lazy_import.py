@@ -0,0 +1,71 @@
+"""
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.0 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+
+"""
+
+import importlib
+import sys
+import threading
+import types
+
+__author__ = "Tim Taylor <timtayl@cisco.com>"
+__contributors__ = ["William Kurkian <wkurkian@cisco.com>"]
+__copyright__ = "Copyright (c) 2019 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.0"
+
+"""
+Deferred imports for the heavy modules, pandas first of all, which takes the better part of a second to import.
+
+    pd = lazy_module('pandas')
+
+binds pd at module load without importing pandas.  pandas is imported the first time one of its attributes is used,
+i.e. pd.DataFrame, so a worker that never touches the license data never pays for it.  Modules that are already
+imported are returned as they are.
+"""
+
+
+class LazyModule(types.ModuleType):
+    def __init__(self, name):
+        super().__init__(name)
+        self.__module = None
+        self.__lock = threading.Lock()
+
+    def __load(self):
+        # webhook handlers run on several threads, only one of them should run the import
+        with self.__lock:
+            if self.__module is None:
+                self.__module = importlib.import_module(self.__name__)
+        return self.__module
+
+    def __getattr__(self, attribute):
+        # only called for the attributes the proxy does not have itself
+        module = self.__module if self.__module is not None else self.__load()
+        return getattr(module, attribute)
+
+    def __dir__(self):
+        return dir(self.__load())
+
+    def __repr__(self):
+        return "<lazy module '{}'{}>".format(self.__name__, '' if self.__module is None else ' (loaded)')
+
+
+def lazy_module(name):
+    """ returns name, to be imported the first time one of its attributes is used"""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    return LazyModule(name)
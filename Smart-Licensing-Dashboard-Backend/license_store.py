@@ -0,0 +1,130 @@
+"""
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.0 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from loguru import logger
+
+import CSSMJSONParser as cssm_parser
+
+__author__ = "Tim Taylor <timtayl@cisco.com>"
+__contributors__ = ["William Kurkian <wkurkian@cisco.com>"]
+__copyright__ = "Copyright (c) 2019 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.0"
+
+"""
+Parse once, share across processes.  The parsed license data of each user is kept as an Arrow snapshot file (see
+CSSMJSONParser.save_snapshot), written by whichever worker process refreshed it, so no worker parses json another one
+already parsed.  Every worker memory-maps that file read-only.  The integer columns and the category codes, most of
+the data, are used in place and the operating system keeps one copy of them in the page cache for all the workers.
+The dates, bools, category labels and subscriptionId strings are copied into each worker that loads the snapshot
+(see CSSMJSONParser.load_snapshot).  On tmpfs, i.e. /dev/shm, the snapshots never touch the disk.
+
+A worker keeps the parser of the snapshot it mapped last and maps the file again once another worker has replaced it.
+Snapshots are replaced by renaming a new file over the old one, so a worker that still maps the old file keeps reading
+consistent data until it moves on.  Only the parsers of the users seen last are kept, the others are mapped again when
+they come back.
+"""
+
+# users whose parser a worker keeps
+LICENSE_STORE_SIZE = 32
+
+
+class LicenseStore(object):
+    def __init__(self, snapshot_dir, maxsize=LICENSE_STORE_SIZE):
+        self.snapshot_dir = snapshot_dir
+        self.maxsize = maxsize
+        # email -> (version of the snapshot file, parser over it), least recently used first
+        self.__parsers = OrderedDict()
+        # the backend serves requests on several threads
+        self.__lock = threading.Lock()
+
+    def snapshot_path(self, email):
+        return os.path.join(self.snapshot_dir, hashlib.sha1(email.encode('utf-8')).hexdigest() + '.arrow')
+
+    @staticmethod
+    def __version(path):
+        # a replaced snapshot is a new file, so its inode changes even if the size and mtime happen not to
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def get(self, email):
+        """ returns the parser of the user's current snapshot, None if there is none"""
+        path = self.snapshot_path(email)
+        version = self.__version(path)
+
+        with self.__lock:
+            cached = self.__parsers.get(email)
+            # a parser whose snapshot could not be saved has no version, it is still the newest this process has
+            if cached is not None and cached[0] == version:
+                self.__parsers.move_to_end(email)
+                return cached[1]
+            # the parser of a replaced or removed snapshot is of no use anymore
+            self.__parsers.pop(email, None)
+        if version is None:
+            return None
+
+        try:
+            parser = cssm_parser.CSSMJSONParser.load_snapshot(path)
+        except (OSError, ValueError) as e:
+            logger.warning("could not load the license snapshot of {}: {!r}".format(email, e))
+            return None
+
+        self.__cache(email, version, parser)
+        return parser
+
+    def put(self, email, parser):
+        """ makes parser the user's snapshot, for this process and the others"""
+        path = self.snapshot_path(email)
+        try:
+            os.makedirs(self.snapshot_dir, exist_ok=True)
+            parser.save_snapshot(path)
+            version = self.__version(path)
+        except (OSError, ValueError, TypeError) as e:
+            # a stale file would hide the new data from the other processes, so drop it and let them parse the json
+            logger.warning("could not save the license snapshot of {}: {!r}".format(email, e))
+            if os.path.exists(path):
+                os.remove(path)
+            version = None
+
+        self.__cache(email, version, parser)
+
+    def __cache(self, email, version, parser):
+        with self.__lock:
+            self.__parsers[email] = (version, parser)
+            self.__parsers.move_to_end(email)
+            while len(self.__parsers) > self.maxsize:
+                self.__parsers.popitem(last=False)
+
+    def refresh(self, email, json_array):
+        """ parses json_array, reusing the rows of the licenses that did not change since the user's last snapshot,
+        and stores the result"""
+        snapshot = self.get(email)
+        if snapshot is None:
+            # an empty parser refreshes into a full parse
+            snapshot = cssm_parser.CSSMJSONParser()
+        parser = snapshot.refresh(json_array)
+
+        self.put(email, parser)
+        return parser
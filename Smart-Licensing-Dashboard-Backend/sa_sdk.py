@@ -18,28 +18,22 @@ or implied.
 """
 
 import threading
+import time
+import random
+import os
+import email.utils
 import requests
+import http_client
 import json
+import ijson
+import CSSMJSONParser as cssm_parser
 from oauthlib.oauth2 import BackendApplicationClient
 from requests_oauthlib import OAuth2Session
-import logging
 import functools
+from concurrent.futures import ThreadPoolExecutor
 from loguru import logger
 
-#The below code enables advanced http debugging, which is currently useful to debugging integration issues.
-try:
-    import http.client as http_client
-except ImportError:
-    # Python 2
-    import httplib as http_client
-http_client.HTTPConnection.debuglevel = 1
-
-# You must initialize logging, otherwise you'll not see debug output.
-logging.basicConfig()
-logging.getLogger().setLevel(logging.DEBUG)
-requests_log = logging.getLogger("requests.packages.urllib3")
-requests_log.setLevel(logging.DEBUG)
-requests_log.propagate = True
+# Wire level tracing of the CSSM calls is off by default, see http_client.enable_wire_trace()
 
 class token_mgr:
     def __init__(self, client_id, client_secret, token_rt, redirect_url):
@@ -57,7 +51,7 @@ class token_mgr:
         #uri = ("https://cloudsso.cisco.com/as/token.oauth2?grant_type=authorization_code&code="+code + "&client_id=" + self.client_id)
         uri = ("https://cloudsso.cisco.com/as/token.oauth2")
         headers = {"Content-Type": "application/x-www-form-urlencoded"}
-        response = requests.post(uri, data=params, headers=headers, verify=True)
+        response = http_client.post(uri, data=params, headers=headers, verify=True)
         print(params)
         print(response.text)
         print(json.dumps(response.json(), indent=4))
@@ -67,7 +61,7 @@ class token_mgr:
     def fetch_email(self, access_token):
         uri = ("https://cloudsso.cisco.com/idp/userinfo.openid")
         headers = {"Authorization": "Bearer " + access_token}
-        response = requests.post(uri, headers=headers, verify=True)
+        response = http_client.post(uri, headers=headers, verify=True)
         print(response.text)
         print(json.dumps(response.json(), indent=4))
         return response.json()
@@ -106,14 +100,124 @@ def logger_wraps(entry=True, exit=True, level="DEBUG"):
 
 
 
+# Number of licenses requested per call to the CSSM licenses API
+LICENSE_PAGE_SIZE = 100
+# Upper bound on the CSSM calls a SmartAccountSDK has in flight at once.  Set to 1 to fetch serially.
+MAX_CONCURRENT_REQUESTS = 8
+
+# Retry policy for CSSM calls.  Transient errors are retried with exponential backoff and jitter, unless CSSM tells us
+# how long to wait with a Retry-After header.
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+MAX_RETRIES = int(os.environ.get('CSSM_MAX_RETRIES', 4))
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+
+# Client side rate limit shared by every SmartAccountSDK in the process.  Keeps a login storm under CSSM's limits.
+CSSM_REQUESTS_PER_SECOND = float(os.environ.get('CSSM_REQUESTS_PER_SECOND', 10))
+CSSM_REQUEST_BURST = int(os.environ.get('CSSM_REQUEST_BURST', 20))
+
+
+class TokenBucket:
+    """ thread safe token bucket.  reserve() takes a token and returns how long the caller has to wait before using
+    it, so that threads can time.sleep() and coroutines can asyncio.sleep() on the same bucket."""
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.__tokens = float(capacity)
+        self.__last = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def reserve(self):
+        with self.__lock:
+            now = time.monotonic()
+            self.__tokens = min(self.capacity, self.__tokens + (now - self.__last) * self.rate)
+            self.__last = now
+            # the balance may go negative: later callers queue up behind the ones already waiting
+            self.__tokens -= 1
+            if self.__tokens >= 0:
+                return 0.0
+            return -self.__tokens / self.rate
+
+    def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+
+cssm_rate_limiter = TokenBucket(CSSM_REQUESTS_PER_SECOND, CSSM_REQUEST_BURST)
+
+
+def retry_delay(attempt, retry_after=None):
+    """ seconds to wait before retry number attempt (0 based).  A Retry-After header, either in seconds or as an
+    HTTP date, wins over the computed backoff, but is capped at BACKOFF_MAX like it."""
+    if retry_after:
+        try:
+            return min(BACKOFF_MAX, max(0.0, float(retry_after)))
+        except ValueError:
+            pass
+        try:
+            return min(BACKOFF_MAX,
+                       max(0.0, email.utils.parsedate_to_datetime(retry_after).timestamp() - time.time()))
+        except (TypeError, ValueError, AttributeError):
+            logger.warning('ignoring unparsable Retry-After: {}'.format(retry_after))
+
+    backoff = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt))
+    return backoff / 2 + random.uniform(0, backoff / 2)
+
+
+class CSSMRequestError(Exception):
+    """ raised by the streaming calls, which cannot hand back a (request_successful, status_code) pair"""
+    def __init__(self, status_code, message):
+        super().__init__(message)
+        self.status_code = status_code
+
+
 class SmartAccountSDK:
     @logger_wraps()
-    def __init__(self, host, token):
+    def __init__(self, host, token, page_size=LICENSE_PAGE_SIZE, max_workers=MAX_CONCURRENT_REQUESTS):
 
         self.host = host
         self.token = token
+        self.page_size = page_size
+        self.max_workers = max_workers
+        self.__request_slots = threading.BoundedSemaphore(max(1, max_workers))
+        # set by list_all_licenses, so the pages of all accounts share one pool instead of one pool per account
+        self.__page_executor = None
         self.__all_licenses = None
 
+    def cssm_request(self, method, uri, request_slots=None, **kwargs):
+        """ sends a request to CSSM through the shared rate limiter, retrying 429/5xx responses and connection errors.
+
+        request_slots, a semaphore, is held while a request is in flight only: it is handed back during the backoff so
+        that a throttled request does not keep the other workers waiting with it."""
+        attempt = 0
+        while True:
+            if request_slots is not None:
+                request_slots.acquire()
+            try:
+                cssm_rate_limiter.acquire()
+                try:
+                    response = http_client.request(method, uri, **kwargs)
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                    if attempt >= MAX_RETRIES:
+                        raise
+                    delay = retry_delay(attempt)
+                    logger.warning('{} {} failed with {}, retrying in {:.1f}s'.format(method, uri, e, delay))
+                else:
+                    if response.status_code not in RETRY_STATUS_CODES or attempt >= MAX_RETRIES:
+                        return response
+                    delay = retry_delay(attempt, response.headers.get('Retry-After'))
+                    logger.warning('{} {} returned {}, retrying in {:.1f}s'.format(method, uri, response.status_code,
+                                                                                   delay))
+                    # hand the connection back to the pool, streamed responses are not read to the end by themselves
+                    response.close()
+            finally:
+                if request_slots is not None:
+                    request_slots.release()
+
+            time.sleep(delay)
+            attempt += 1
+
     @logger_wraps()
     def list_accounts(self):
         """ returns all accounts assocaited with a user"""
@@ -122,7 +226,7 @@ class SmartAccountSDK:
         uri = ("https://" + self.host + call)
         headers = {"Content-Type": "application/json", "Authorization": "Bearer " + self.token}
         logger.info("done preparing request")
-        response = requests.get(uri, headers=headers, verify=True)
+        response = self.cssm_request("GET", uri, headers=headers, verify=True)
         logger.info("received response")
 
         request_successful = False
@@ -139,53 +243,167 @@ class SmartAccountSDK:
                 logger.info(" response body:  \n{}".format(response.json()))
             except:
                 logger.info(" no response body")
-        logger.info('list_accounts json: \n{}'.format(json.dumps(response_json, indent=4)))
+        #logger.info('list_accounts json: \n{}'.format(json.dumps(response_json, indent=4)))
         return request_successful, response.status_code, response_json
 
-    @logger_wraps()
-    def list_licenses(self, sa_domain, virtual_accounts):
+    def __license_page(self, sa_domain, virtual_accounts, offset, limit):
+        """ requests one page of licenses.  The semaphore bounds the calls in flight across all worker threads"""
         call = "/services/api/smart-accounts-and-licensing/v1/accounts/" + sa_domain + "/licenses"
         uri = ("https://" + self.host + call)
 
         headers = {"Content-Type": "application/json", "Authorization": "Bearer " + self.token}
-        body = {"limit": 100, "offset": 0, 'virtualAccounts': virtual_accounts}
-        # if len(virtual_accounts) > 0:
-        #     body['virtualAccounts'] = (virtual_accounts)
-
+        body = {"limit": limit, "offset": offset, 'virtualAccounts': virtual_accounts}
         #logger.info('list_licenses json body: \n{}'.format(body))
 
-        response = requests.post(uri, headers=headers, data=json.dumps(body), verify=True)
+        response = self.cssm_request("POST", uri, request_slots=self.__request_slots, headers=headers,
+                                     data=json.dumps(body), verify=True)
 
         logger.info(" response status code:  {}".format(response.status_code))
 
         status_code = response.status_code
-        request_successful = False
-        response_json = None
-        if status_code == 200:
-            logger.info("request was successful. status code 200")
-            response_json = response.json()
-            request_successful = True
-        else:
+        if status_code != 200:
             logger.info(" response not successful, response status code:  {}".format(response.status_code))
             try:
                 logger.info(" response body:  \n{}".format(response.json()))
             except:
                 logger.info(" no response body")
+            return False, status_code, None
+
+        logger.info("request was successful. status code 200, offset: {}".format(offset))
+        return True, status_code, response.json()
+
+    @logger_wraps()
+    def stream_licenses(self, sa_domain, virtual_accounts, page_size=None):
+        """ Generator of the license dicts of a Smart Account.
+
+        Each page is decoded incrementally from the response stream, one element of the licenses array at a time, so
+        the decoded page is never held in memory.  Raises CSSMRequestError if a page fails.
+        """
+        call = "/services/api/smart-accounts-and-licensing/v1/accounts/" + sa_domain + "/licenses"
+        uri = ("https://" + self.host + call)
+
+        headers = {"Content-Type": "application/json", "Authorization": "Bearer " + self.token}
+        limit = page_size or self.page_size
+        offset = 0
+
+        while True:
+            body = {"limit": limit, "offset": offset, 'virtualAccounts': virtual_accounts}
+            response = self.cssm_request("POST", uri, request_slots=self.__request_slots, headers=headers,
+                                         data=json.dumps(body), verify=True, stream=True)
+
+            with response:
+                if response.status_code != 200:
+                    logger.info(" response not successful, response status code:  {}".format(response.status_code))
+                    raise CSSMRequestError(response.status_code,
+                                           'list_licenses failed for {}, offset {}'.format(sa_domain, offset))
+
+                # let urllib3 undo any gzip/deflate before ijson sees the bytes
+                response.raw.decode_content = True
+                page_size_received = 0
+                for license_dict in ijson.items(response.raw, 'licenses.item', use_float=True):
+                    page_size_received += 1
+                    yield license_dict
+
+            logger.info("streamed {} licenses, offset: {}".format(page_size_received, offset))
+            offset += page_size_received
+            if page_size_received < limit:
+                return
+
+    @logger_wraps()
+    def stream_all_licenses(self):
+        """ Generator of (account, licenses) pairs for every Smart Account of the user, where licenses is the
+        stream_licenses() generator of the account.  Meant for CSSMJSONParser(license_stream=...), which consumes each
+        account's licenses before asking for the next account."""
+        request_successful, status_code, the_accounts = self.list_accounts()
+        if not request_successful:
+            raise CSSMRequestError(status_code, 'list_accounts failed')
+
+        for sa in the_accounts.get("accounts"):
+            yield sa, self.stream_licenses(sa.get("accountDomain"), [])
+
+    @logger_wraps()
+    def list_license_pages(self, sa_domain, virtual_accounts, page_size=None, offset=0):
+        """ Generator that walks the licenses of a Smart Account one page at a time.
+
+        Yields (request_successful, status_code, response_json) for each page so that the caller can start
+        working on the licenses before the last page has arrived.  Stops after the last page or the first failure.
+        """
+        limit = page_size or self.page_size
+
+        while True:
+            request_successful, status_code, response_json = self.__license_page(sa_domain, virtual_accounts,
+                                                                                  offset, limit)
+            yield request_successful, status_code, response_json
+            if not request_successful:
+                return
+
+            page_licenses = response_json.get("licenses") or []
+            offset += len(page_licenses)
+            # totalRecords can be stale, i.e. licenses added while we page, so only a short page means we are done
+            if len(page_licenses) < limit:
+                return
+
+    @logger_wraps()
+    def list_licenses(self, sa_domain, virtual_accounts, page_size=None):
+        """ returns all the licenses of a Smart Account, following the pages until everything is retrieved.
+
+        Once the first page tells us totalRecords the remaining pages are requested concurrently and merged back
+        in offset order.  totalRecords can be stale, so if the last of those pages is full the pages after it are
+        followed one at a time.
+        """
+        limit = page_size or self.page_size
+
+        request_successful, status_code, response_json = self.__license_page(sa_domain, virtual_accounts, 0, limit)
+        if not request_successful:
+            return request_successful, status_code, None
+
+        response_json["licenses"] = list(response_json.get("licenses") or [])
+        total_records = response_json.get("totalRecords")
+
+        pages = []
+        if len(response_json["licenses"]) == limit and total_records is not None and self.max_workers > 1:
+            offsets = range(limit, total_records, limit)
+            pages = self.__map_pages(lambda offset: self.__license_page(sa_domain, virtual_accounts, offset, limit),
+                                     offsets)
+
+        last_page_size = len(response_json["licenses"])
+        for page_successful, status_code, page_json in pages:
+            if not page_successful:
+                # a partial license list would look like a real one on the dashboard, so fail the whole request.
+                return False, status_code, None
+            page_licenses = page_json.get("licenses") or []
+            response_json["licenses"].extend(page_licenses)
+            last_page_size = len(page_licenses)
+
+        if last_page_size == limit:
+            offset = len(response_json["licenses"])
+            for page_successful, status_code, page_json in self.list_license_pages(sa_domain, virtual_accounts,
+                                                                                   limit, offset=offset):
+                if not page_successful:
+                    return False, status_code, None
+                response_json["licenses"].extend(page_json.get("licenses") or [])
 
         #logger.info('list_licenses json: \n{}'.format(json.dumps(response_json, indent=4)))
-        return request_successful, status_code, response_json
+        return True, status_code, response_json
+
+    def __map_pages(self, fetch_page, offsets):
+        if self.__page_executor is not None:
+            return list(self.__page_executor.map(fetch_page, offsets))
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(fetch_page, offsets))
 
     @logger_wraps()
     def retrieve_and_process_licenses(self, sa, virtual_account_list):
+        """ retrieves the licenses for virtual_account_list ([] means the whole domain) and attaches them to sa"""
         account_domain = sa.get("accountDomain")
         logger.info('account domain:  {}'.format(account_domain))
         logger.info('virtual_account_list: \n{}'.format(virtual_account_list))
 
-        request_successful, status_code, json_array = self.list_licenses(account_domain, [])
+        request_successful, status_code, json_array = self.list_licenses(account_domain, virtual_account_list)
 
         if request_successful == False:
             logger.info('Failure with list_licenses. status code: {}'.format(status_code))
-            logger.info('account domain: {}\nvirtual_account_list: {}'.format(account_domain, []))
+            logger.info('account domain: {}\nvirtual_account_list: {}'.format(account_domain, virtual_account_list))
         else:
             logger.info('Success with list_licenses. status code: {}'.format(status_code))
 
@@ -193,48 +411,46 @@ class SmartAccountSDK:
             logger.info('list_licenses request_successful: {}\n'.format(request_successful))
             #   logger.info('size of domain_licenses: {}\n'.format(len(domain_licenses)))
 
-            va_dict = {}
-            # Sort licenses into lists and  put them into dictionary with key = virtualAccount
-            for lic in domain_licenses:
-                #      logger.info('license:  {}'.format(lic))
-                if lic["virtualAccount"] not in va_dict.keys():
-                    #         logger.info('license not in va_dict keys: {}'.format({lic["virtualAccount"]: [lic]}))
-                    va_dict.update({lic["virtualAccount"]: [lic]})
-                else:
-                    va_dict[lic["virtualAccount"]].append(lic)
-
-            # logger.info('va_dict:  {}'.format(va_dict))
-            # append each list of accounts associated with virtual account under that sa/va in accounts
-            # for va in sa.get("roles"):
-            #     if va.get("virtualAccount") in va_dict.keys():
-            #         va.update({"licenses": va_dict[va.get("virtualAccount")]})
-            #     else:
-            #         va.update({"licenses": []})
-
-            logger.info('starting new part of parser')
-            for the_virtual_account_key, licenses in va_dict.items():
-                logger.info('the_virtual_account_key: {}\n'.format(the_virtual_account_key))
-                the_roles = sa.get("roles")
-                isFound = False
-                for the_role in the_roles:
-                    if "virtualAccount" in the_role:
-                        if the_virtual_account_key == the_role['virtualAccount']:
-                            logger.info('found: {}'.format(the_virtual_account_key))
-                            isFound = True
-                            the_role.update({"licenses": licenses})
-
-                if isFound == False:
-                    the_roles.append({'role': "APPENDED VA USER", \
-                                      "virtualAccount": the_virtual_account_key,
-                                      "licenses": licenses})
+            self.attach_licenses(sa, domain_licenses)
 
         return request_successful, status_code
 
+    @staticmethod
+    def attach_licenses(sa, domain_licenses):
+        """ sorts the licenses of a domain by virtual account and attaches them to the roles of sa.  The parser
+        attaches streamed licenses with the same code, see CSSMJSONParser.attach_licenses"""
+        cssm_parser.attach_licenses(sa, domain_licenses)
+
+    @staticmethod
+    def reconcile_roles(sa, va_dict):
+        """ attaches each virtual account's licenses to its role, see CSSMJSONParser.reconcile_roles"""
+        cssm_parser.reconcile_roles(sa, va_dict)
+
+    @logger_wraps()
+    def retrieve_account_licenses(self, sa):
+        """ retrieves the licenses of one Smart Account and attaches them to its roles.
+
+        Asking for the empty virtual accounts list returns every license of the domain, including the ones that are
+        not in any of the user's virtual accounts, so a single request set per domain covers all the virtual accounts
+        in roles.  reconcile_roles then takes care of the virtual accounts missing from roles.
+        """
+        logger.info('Getting licenses with virtual accounts set to []')
+        account_request_success, status_code = self.retrieve_and_process_licenses(sa, [])
+        if account_request_success:
+            logger.success('Domain licenses\n     successful: {}\n' \
+                           '     status code: {}'.format(account_request_success, status_code))
+        else:
+            logger.error('Domain licenses\n     successful: {}\n' \
+                           '     status code: {}'.format(account_request_success, status_code))
+
+        logger.info('account_request_success: {}, for domain: {}'.format(account_request_success,
+                                                                         sa.get("accountDomain")))
+        return account_request_success, status_code
+
     @logger_wraps()
     def list_all_licenses(self):
 
-        empty_virt_account_request_successful = False
-        virt_account_request_successful = False
+        overall_request_successful = False
         status_code = -999
         if self.__all_licenses == None:
 
@@ -244,53 +460,30 @@ class SmartAccountSDK:
 
             if request_successful:
                 accounts = the_accounts.get("accounts")
-                for sa in accounts:
-                    # create list of virtual accounts under Smart Account
-                    is_empty_virt_account_pass = True
-
-                    # first the empty virtual accounts list to try and get everything because some licenses may not
-                    # actually be in the virtual accounts.
-                    logger.info('Starting getting licenses with virtual accounts set to []')
-                    empty_virt_account_request_successful, status_code = self.retrieve_and_process_licenses(sa, [])
-                    if empty_virt_account_request_successful:
-                        logger.success('Empty virtual accounts\n     successful: {}\n' \
-                                       '     status code: {}'.format(empty_virt_account_request_successful, status_code))
-                    else:
-                        logger.error('Empty virtual accounts\n     successful: {}\n' \
-                                       '     status code: {}'.format(empty_virt_account_request_successful,
-                                                                     status_code))
-
-                    virtual_account_list = [va.get("virtualAccount") for va in sa.get("roles") if va.get("virtualAccount")]
-
-                    logger.info('Starting getting licenses with virtual accounts set actual virtual accounts')
-                    logger.error('  virtual_account_list: {}'.format(virtual_account_list))
-                    # next get the licenses for the virtual accounts
-                    if len(virtual_account_list) > 0:
-                        logger.info('Virtual Accounts length was greater than zero')
-                        virt_account_request_successful, status_code = self.retrieve_and_process_licenses(sa, virtual_account_list)
-                        if virt_account_request_successful:
-                            logger.success('Full virtual accounts\n     successful: {}\n' \
-                                           'status code: {}'.format(virt_account_request_successful, status_code))
-                        else:
-                            logger.error('Full virtual accounts\n     successful: {}\n' \
-                                           'status code: {}'.format(virt_account_request_successful, status_code))
-
-
-                    else:
-                        logger.info('Virtual Accounts length was 0')
-
-                    account_request_success = (empty_virt_account_request_successful or virt_account_request_successful)
-                    logger.error('account_request_success: {}, for domain: {}'.format(account_request_success,
-                                                                                      sa.get("accountDomain")))
 
+                # Each account only touches its own roles, so the accounts can be fetched side by side.  map() hands
+                # the results back in account order, which keeps the merged result deterministic.  The accounts
+                # share one pool for their pages, so there are at most 2 * max_workers threads, whatever the number
+                # of accounts.  It has to be a pool of its own: account threads waiting on pages of the same pool
+                # could take all of its threads.
+                if self.max_workers > 1 and len(accounts) > 1:
+                    with ThreadPoolExecutor(max_workers=self.max_workers) as executor, \
+                            ThreadPoolExecutor(max_workers=self.max_workers) as page_executor:
+                        self.__page_executor = page_executor
+                        try:
+                            results = list(executor.map(self.retrieve_account_licenses, accounts))
+                        finally:
+                            self.__page_executor = None
+                else:
+                    results = [self.retrieve_account_licenses(sa) for sa in accounts]
 
+                for account_request_success, status_code in results:
+                    overall_request_successful = overall_request_successful or account_request_success
 
                 self.__all_licenses = accounts
+        else:
+            overall_request_successful = True
 
-        overall_request_successful = (empty_virt_account_request_successful or virt_account_request_successful)
         logger.info("request_successful: {}, status code: {}".format(overall_request_successful, status_code))
 
         return overall_request_successful, self.__all_licenses
-
-
-
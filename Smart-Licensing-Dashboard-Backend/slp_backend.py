@@ -17,14 +17,15 @@ or implied.
 
 """
 
-from sa_sdk import SmartAccountSDK, token_mgr
+from sa_sdk import SmartAccountSDK, CSSMRequestError, token_mgr
 import CSSMJSONParser as cssm_parser
+from lazy_import import lazy_module
+from license_store import LicenseStore
 import connexion
 import json
 import hmac
 import hashlib
 import datetime as dt
-from dateutil import parser
 from WBXTeamsBEIntegration import WBXTeamsBEIntegration
 import connexion
 from flask import Flask, request, send_from_directory, redirect, url_for, jsonify
@@ -33,9 +34,16 @@ from loguru import logger
 import threading
 import time
 import redis
+import asyncio
+import contextlib
+import functools
 
 from WBXTeamsMeetingRoom import WBXTeamsMeetingRoom as wbx_meeting_room
 
+# aiohttp is only needed once a login starts a license refresh, and pandas, behind CSSMJSONParser and CSSMLicense, only
+# once license data is parsed or queried.  Neither is imported when a worker starts.
+async_sa_sdk = lazy_module('async_sa_sdk')
+
 # Program variables
 token_rt = 3500  # How often the access token should be refreshed in seconds
 
@@ -49,11 +57,21 @@ token_mgr = token_mgr(client_id, client_secret, token_rt, redirect_url)
 
 redis_db = redis.Redis()
 
+# All the license refreshes started by logins run on this one event loop, instead of one blocking thread per login
+refresh_loop = asyncio.new_event_loop()
+threading.Thread(target=refresh_loop.run_forever, name='license-refresh-loop', daemon=True).start()
+
 tokens = {}
 teams_ids = {}
 session_ids = {}
 license_cache = {}
-license_cache_lock = {}
+# The parsed license data of each user, shared by all worker processes.  Lets a refresh reparse only the licenses that
+# changed and lets every worker map what another one parsed.  Next to this file by default, whatever directory uWSGI
+# starts the workers in.
+license_store = LicenseStore(os.environ.get('SLD_LICENSE_SNAPSHOT_DIR',
+                                            os.path.join(os.path.dirname(os.path.abspath(__file__)), 'license_snapshots')))
+# A license refresh holds this redis lock, so the endpoints of every worker process wait for it
+license_lock_timeout = 600
 
 # For WebexTeams Bot integration, set the secret key in your environment.  Uncomment out the following once this is done.
 sld_bot_key = os.environ.get('SLD_SMART_BOT_SECRET_KEY')
@@ -179,16 +197,13 @@ def account():
         success, token, email = getAccessTokenBySession(session_id)
         if success:
             logger.info("Obtained token. Getting expired licenses")
-            while email in license_cache_lock.keys():
+            while license_refresh_in_progress(email):
                 time.sleep(.1)
-            json_array = redis_db.get("license_"+email)
-            if not json_array is None:
-                logger.info("Using cached data")
-                #cssm_license = license_cache[email]
-                parser = cssm_parser.CSSMJSONParser(json.loads(json_array.decode()))
-                cssm_license = parser.cssm_license()
-            else:
-                success, cssm_license = get_cssm_license(token)
+            cssm_license = get_cached_cssm_license(email)
+            if cssm_license is None:
+                success, cssm_license = stream_cssm_license(token)
+                if not success:
+                    return "", 404
             return jsonify(cssm_license.cssm_virt_account_by_accountName()), 200
         else:
             return "", 404
@@ -204,16 +219,13 @@ def customer():
         filter_data = json.loads(request.data.decode())
         if success:
             logger.info("Obtained token. Getting expired licenses")
-            while email in license_cache_lock.keys():
+            while license_refresh_in_progress(email):
                 time.sleep(.1)
-            json_array = redis_db.get("license_"+email)
-            if not json_array is None:
-                logger.info("Using cached data")
-                #cssm_license = license_cache[email]
-                parser = cssm_parser.CSSMJSONParser(json.loads(json_array.decode()))
-                cssm_license = parser.cssm_license()
-            else:
-                success, cssm_license = get_cssm_license(token)
+            cssm_license = get_cached_cssm_license(email)
+            if cssm_license is None:
+                success, cssm_license = stream_cssm_license(token)
+                if not success:
+                    return "", 404
             return jsonify(cssm_license.cssm_top_license_customer_dict(get_va_list(cssm_license,filter_data))), 200
         else:
             return "", 404
@@ -228,16 +240,13 @@ def technology():
         filter_data = json.loads(request.data.decode())
         if success:
             logger.info("Obtained token. Getting expired licenses")
-            while email in license_cache_lock.keys():
+            while license_refresh_in_progress(email):
                 time.sleep(.1)
-            json_array = redis_db.get("license_"+email)
-            if not json_array is None:
-                logger.info("Using cached data")
-                #cssm_license = license_cache[email]
-                parser = cssm_parser.CSSMJSONParser(json.loads(json_array.decode()))
-                cssm_license = parser.cssm_license()
-            else:
-                success, cssm_license = get_cssm_license(token)
+            cssm_license = get_cached_cssm_license(email)
+            if cssm_license is None:
+                success, cssm_license = stream_cssm_license(token)
+                if not success:
+                    return "", 404
             return jsonify(cssm_license.cssm_top_license_technology_dict(get_va_list(cssm_license,filter_data))), 200
         else:
             return "", 404
@@ -252,16 +261,13 @@ def expired_license():
         filter_data = json.loads(request.data.decode())
         if success:
             logger.info("Obtained token. Getting expired licenses")
-            while email in license_cache_lock.keys():
+            while license_refresh_in_progress(email):
                 time.sleep(.5)
-            json_array = redis_db.get("license_"+email)
-            if not json_array is None:
-                logger.info("Using cached data")
-                #cssm_license = license_cache[email]
-                parser = cssm_parser.CSSMJSONParser(json.loads(json_array.decode()))
-                cssm_license = parser.cssm_license()
-            else:
-                success, cssm_license = get_cssm_license(token)
+            cssm_license = get_cached_cssm_license(email)
+            if cssm_license is None:
+                success, cssm_license = stream_cssm_license(token)
+                if not success:
+                    return "", 404
             return jsonify(cssm_license.cssm_top_five_future_expired_licenses(get_va_list(cssm_license,filter_data))), 200
         else:
             return "", 404
@@ -309,26 +315,83 @@ def login():
         #session_ids[session_id] = email.get("email")
         redis_db.set("session_"+session_id, email.get("email"))
 
-        #start license load thread for caching data
-        t = threading.Thread(target=license_cacher, args=(email.get("email"),token.get("access_token")))
-        t.start()
+        #start license load on the refresh loop for caching data
+        refresh = asyncio.run_coroutine_threadsafe(license_cacher(email.get("email"), token.get("access_token")),
+                                                   refresh_loop)
+        # nobody waits on the refresh, so its failures are logged when it is done
+        refresh.add_done_callback(functools.partial(log_license_cacher_failure, email.get("email")))
 
         return redirect(url_for('home'))
 
 
-def license_cacher(email, token):
-    """thread worker function"""
-    while email in license_cache_lock.keys():
+async def license_cacher(email, token):
+    """refresh_loop worker coroutine"""
+    lock_key = "license_lock_" + email
+    # redis calls, json encoding and parsing block, so they all run in the executor to keep the refresh loop free for
+    # the other users' refreshes
+    acquire_lock = functools.partial(redis_db.set, lock_key, 1, nx=True, ex=license_lock_timeout)
+    while not await refresh_loop.run_in_executor(None, acquire_lock):
+        await asyncio.sleep(.5)
+    try:
+        async with async_sa_sdk.AsyncSmartAccountSDK("apx.cisco.com", token) as smart_account:
+            success, json_array = await smart_account.list_all_licenses()
+        if success:
+            logger.info("license info cached")
+            #license_cache[email] = cssm_license
+            await refresh_loop.run_in_executor(None, store_licenses, email, json_array)
+        else:
+            logger.info("License cache request failed")
+    finally:
+        # the endpoints wait on this lock, so it has to be released even if the refresh blew up
+        await refresh_loop.run_in_executor(None, redis_db.delete, lock_key)
+
+def log_license_cacher_failure(email, future):
+    """done callback of a license_cacher future"""
+    if future.cancelled():
+        logger.warning("license refresh of {} was cancelled".format(email))
+    elif future.exception() is not None:
+        logger.opt(exception=future.exception()).error("license refresh of {} failed".format(email))
+
+def store_licenses(email, json_array):
+    """caches json_array in redis and refreshes the user's snapshot from it"""
+    redis_db.set("license_"+email, json.dumps(json_array))
+    license_store.refresh(email, json_array)
+
+def license_refresh_in_progress(email):
+    return redis_db.exists("license_lock_" + email)
+
+@contextlib.contextmanager
+def license_lock(email):
+    """holds the user's refresh lock, the one license_cacher takes, for a refresh outside the refresh loop"""
+    lock_key = "license_lock_" + email
+    while not redis_db.set(lock_key, 1, nx=True, ex=license_lock_timeout):
         time.sleep(.5)
-    license_cache_lock[email] = True
-    success, json_array = get_cssm_license(token)
-    if success:
-        logger.info("license info cached")
-        #license_cache[email] = cssm_license
-        redis_db.set("license_"+email, json.dumps(json_array))
-    else:
-        logger.info("License cache request failed")
-    del license_cache_lock[email]
+    try:
+        yield
+    finally:
+        redis_db.delete(lock_key)
+
+def get_cached_cssm_license(email):
+    """returns a CSSMLicense over the user's shared snapshot or the redis cache, None if nothing is cached"""
+    snapshot = license_store.get(email)
+    if snapshot is None:
+        if not redis_db.exists("license_"+email):
+            return None
+
+        # rebuilding the snapshot from the redis cache is a refresh too, it must not run alongside license_cacher's
+        with license_lock(email):
+            # a refresh that held the lock meanwhile has stored a snapshot
+            snapshot = license_store.get(email)
+            if snapshot is None:
+                json_array = redis_db.get("license_"+email)
+                if json_array is None:
+                    return None
+                logger.info("Using cached data")
+                snapshot = license_store.refresh(email, json.loads(json_array.decode()))
+
+    # the requests of a user share the CSSMLicense of their snapshot, so a filter that was asked for before is served from
+    # its cache until the next refresh
+    return snapshot.cssm_license()
 
 def get_va_list(cssm_license, filter_data):
     va_list = []
@@ -385,6 +448,18 @@ def get_cssm_license(account_credentials=""):
 
     return request_successful, json_array
 
+def stream_cssm_license(account_credentials=""):
+    """builds the CSSMLicense straight from the CSSM response streams, for requests that find nothing cached"""
+    smart_account = SmartAccountSDK("apx.cisco.com", account_credentials)
+    parser = cssm_parser.CSSMJSONParser(license_stream=smart_account.stream_all_licenses())
+    try:
+        cssm_license = parser.cssm_license()
+    except CSSMRequestError as e:
+        logger.info('streaming the licenses failed, status code: {}, {}'.format(e.status_code, e))
+        return False, None
+
+    return True, cssm_license
+
 if __name__ == "__main__":
     flask_port = 10000
 
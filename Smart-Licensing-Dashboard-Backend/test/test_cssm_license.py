@@ -0,0 +1,153 @@
+"""
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.0 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+
+"""
+
+import unittest
+import json
+import os
+import shutil
+import tempfile
+from unittest import mock
+import numpy as np
+import pandas as pd
+import CSSMLicense
+
+__author__ = "Tim Taylor <timtayl@cisco.com>"
+__contributors__ = ["William Kurkian <wkurkian@cisco.com>"]
+__copyright__ = "Copyright (c) 2019 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.0"
+
+
+# catalog order matters: the first name of the catalog found in a virtual account wins
+CUSTOMER_CATALOG = [("ATT", "AT&T"),
+                    ("XATT", "Xatt Holdings"),
+                    ("AT", "Atlas"),
+                    ("Big", "Big Corp"),
+                    ("BT", "BT")]
+
+VIRTUAL_ACCOUNTS = ["ATT EE CUSTOMER C", "XATT lab", "ATLAS", "Big ATT deal", "Big BT", "BTS", "DEFAULT", "att", ""]
+
+
+def first_customer(catalog, virtual_account):
+    """ the matching rule, one catalog name after the other"""
+    for name, customer in catalog:
+        if name in virtual_account:
+            return customer
+    return "None"
+
+
+class CustomerMatcherTest(unittest.TestCase):
+    def setUp(self):
+        catalog_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, catalog_dir)
+        self.catalog_path = os.path.join(catalog_dir, 'customer_json')
+        with open(self.catalog_path, 'w') as fp:
+            # json objects keep their order
+            json.dump({name: {"customer": customer} for name, customer in CUSTOMER_CATALOG}, fp)
+        self.match = CSSMLicense.customer_matcher(self.catalog_path)
+
+    def test_matches_the_first_catalog_name(self):
+        for virtual_account in VIRTUAL_ACCOUNTS:
+            self.assertEqual(first_customer(CUSTOMER_CATALOG, virtual_account), self.match(virtual_account),
+                             virtual_account)
+
+    def test_name_inside_a_longer_name(self):
+        # "XATT" starts first in the virtual account, but "ATT" inside it comes first in the catalog
+        self.assertEqual("AT&T", self.match("XATT lab"))
+
+    def test_name_that_is_a_prefix_of_another(self):
+        # "AT" is a prefix of "ATT", which comes first in the catalog
+        self.assertEqual("AT&T", self.match("ATT EE CUSTOMER C"))
+        self.assertEqual("Atlas", self.match("ATLAS"))
+
+    def test_tie_broken_by_catalog_order(self):
+        # both names are in the virtual account, the one listed first in the catalog wins wherever it is
+        self.assertEqual("AT&T", self.match("Big ATT deal"))
+        self.assertEqual("Big Corp", self.match("Big BT"))
+        self.assertEqual("BT", self.match("BTS"))
+
+    def test_no_match(self):
+        self.assertEqual("None", self.match("DEFAULT"))
+        self.assertEqual("None", self.match("att"))
+        self.assertEqual("None", self.match(None))
+
+    def test_license_customer(self):
+        virtual_accounts = pd.Series(VIRTUAL_ACCOUNTS + VIRTUAL_ACCOUNTS, dtype='category')
+
+        with mock.patch.object(CSSMLicense, 'customer_matcher', return_value=self.match):
+            result = CSSMLicense.license_customer(virtual_accounts)
+
+        expected = [first_customer(CUSTOMER_CATALOG, virtual_account) for virtual_account in virtual_accounts]
+        self.assertEqual(expected, list(result))
+        self.assertEqual(object, result.dtype)
+
+
+# rows of (accountName, virtualAccount), interleaved.  DEFAULT is a virtual account of two accounts, and
+# ("Lab_East", "Core") and ("Lab", "East_Core") share the key "Lab_East_Core".
+ACCOUNT_ROWS = [("SA SME", "DEFAULT"), ("Cisco Sales Enablement", "DEFAULT"), ("SA SME", "AT&T"),
+                ("Lab_East", "Core"), ("SA SME", "DEFAULT"), ("Lab", "East_Core"), ("Cisco Sales Enablement", "DEFAULT"),
+                ("SA SME", "AT&T"), ("Lab_East", "Core")]
+
+VA_LISTS = [[], ["SA SME_DEFAULT"], ["Cisco Sales Enablement_DEFAULT", "SA SME_AT&T"], ["Lab_East_Core"],
+            ["SA SME_DEFAULT", "SA SME_DEFAULT"], ["DEFAULT"], ["SA SME_Unknown"]]
+
+
+class FullAccountIndexTest(unittest.TestCase):
+    def licenses(self, dtype):
+        df = pd.DataFrame(ACCOUNT_ROWS, columns=['accountName', 'virtualAccount'], dtype=dtype)
+        df['inUse'] = range(len(df))
+        return CSSMLicense.CSSMLicense(df)
+
+    @staticmethod
+    def full_account_filter(df, va_list):
+        """ the filter the requests used to apply, on a fullAccount column added to the whole frame"""
+        full_account = df["accountName"].astype(str) + "_" + df["virtualAccount"].astype(str)
+        return full_account.isin(va_list).values
+
+    def test_va_mask_matches_full_account_filter(self):
+        for dtype in (object, 'category'):
+            the_license = self.licenses(dtype)
+            for va_list in VA_LISTS:
+                np.testing.assert_array_equal(self.full_account_filter(the_license.cssm_dataframe, va_list),
+                                              the_license.va_mask(va_list), '{} {}'.format(dtype, va_list))
+
+    def test_full_account_rows(self):
+        the_license = self.licenses('category')
+        df = the_license.cssm_dataframe
+
+        full_account_rows = the_license.full_account_rows()
+
+        full_accounts = set(df["accountName"].astype(str) + "_" + df["virtualAccount"].astype(str))
+        self.assertEqual(full_accounts, set(full_account_rows))
+        for full_account, rows in full_account_rows.items():
+            np.testing.assert_array_equal(np.flatnonzero(self.full_account_filter(df, [full_account])),
+                                          np.sort(rows), full_account)
+        # the virtual account of two accounts keeps their rows apart
+        self.assertEqual([0, 4], sorted(full_account_rows["SA SME_DEFAULT"]))
+        self.assertEqual([1, 6], sorted(full_account_rows["Cisco Sales Enablement_DEFAULT"]))
+        self.assertEqual([3, 5, 8], sorted(full_account_rows["Lab_East_Core"]))
+
+    def test_empty_dataframe(self):
+        the_license = CSSMLicense.CSSMLicense(pd.DataFrame(columns=['accountName', 'virtualAccount']))
+
+        self.assertEqual({}, the_license.full_account_rows())
+        self.assertEqual(0, len(the_license.va_mask(["SA SME_DEFAULT"])))
+
+
+if __name__ == '__main__':
+    unittest.main()
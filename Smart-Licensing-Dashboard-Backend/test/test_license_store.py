@@ -0,0 +1,148 @@
+"""
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.0 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+
+"""
+
+import unittest
+import os
+import shutil
+import tempfile
+import pandas as pd
+import CSSMJSONParser as cssm_parser
+from license_store import LicenseStore
+
+__author__ = "Tim Taylor <timtayl@cisco.com>"
+__contributors__ = ["William Kurkian <wkurkian@cisco.com>"]
+__copyright__ = "Copyright (c) 2019 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.0"
+
+
+def account_list(in_use=10):
+    return [{'accountType': 'CUSTOMER', 'accountName': 'SA SME', 'accountDomain': 'sasme.cisco.com', 'accountStatus': 'Active',
+             'roles': [{'role': 'Virtual Account Administrator', 'virtualAccount': 'AT&T', 'licenses': [
+                 {'license': 'ISRV AX 1G', 'reserved': 0, 'billingType': 'PREPAID', 'isPortable': False, 'virtualAccount': 'AT&T', 'ahaApps': False, 'pendingQuantity': 0,
+                  'licenseDetails': [{'startDate': '2019-05-20', 'endDate': '2022-05-19', 'subscriptionId': 'Sub269233', 'status': 'ACTIVE', 'licenseType': 'TERM', 'quantity': 50}],
+                  'licenseSubstitutions': [], 'available': 50, 'inUse': in_use, 'quantity': 50, 'status': 'In Compliance'}]}]}]
+
+
+class LicenseStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.snapshot_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.snapshot_dir)
+        # two stores over one directory stand for two worker processes
+        self.writer = LicenseStore(self.snapshot_dir)
+        self.reader = LicenseStore(self.snapshot_dir)
+
+    def test_no_snapshot(self):
+        self.assertIsNone(self.reader.get('user@cisco.com'))
+
+    def test_snapshot_is_shared_with_other_stores(self):
+        parser = self.writer.refresh('user@cisco.com', account_list())
+
+        snapshot = self.reader.get('user@cisco.com')
+
+        pd.testing.assert_frame_equal(parser.cssm_dataframe(), snapshot.cssm_dataframe())
+        self.assertEqual(parser.license_fingerprints(), snapshot.license_fingerprints())
+
+    def test_unchanged_snapshot_is_not_loaded_again(self):
+        self.writer.refresh('user@cisco.com', account_list())
+
+        self.assertIs(self.reader.get('user@cisco.com'), self.reader.get('user@cisco.com'))
+
+    def test_replaced_snapshot_is_loaded_again(self):
+        self.writer.refresh('user@cisco.com', account_list(in_use=10))
+        first = self.reader.get('user@cisco.com')
+
+        self.writer.refresh('user@cisco.com', account_list(in_use=20))
+        second = self.reader.get('user@cisco.com')
+
+        self.assertIsNot(first, second)
+        self.assertEqual([20], list(second.cssm_dataframe()['inUse']))
+        # the old mapping is still readable by whoever holds it
+        self.assertEqual([10], list(first.cssm_dataframe()['inUse']))
+
+    def test_replacement_with_same_size_and_mtime_is_noticed(self):
+        path = self.writer.snapshot_path('user@cisco.com')
+        self.writer.refresh('user@cisco.com', account_list(in_use=10))
+        first = self.reader.get('user@cisco.com')
+        first_stat = os.stat(path)
+
+        # another process renames a snapshot of the same size over the old one within the same mtime tick
+        other_path = os.path.join(self.snapshot_dir, 'other.arrow')
+        cssm_parser.CSSMJSONParser(account_list(in_use=20)).save_snapshot(other_path)
+        self.assertEqual(first_stat.st_size, os.stat(other_path).st_size)
+        os.utime(other_path, ns=(first_stat.st_atime_ns, first_stat.st_mtime_ns))
+        os.replace(other_path, path)
+
+        second = self.reader.get('user@cisco.com')
+
+        self.assertIsNot(first, second)
+        self.assertEqual([20], list(second.cssm_dataframe()['inUse']))
+
+    def test_parsers_are_cached_per_email(self):
+        self.writer.refresh('first@cisco.com', account_list(in_use=10))
+        self.writer.refresh('second@cisco.com', account_list(in_use=20))
+
+        self.assertNotEqual(self.reader.snapshot_path('first@cisco.com'),
+                            self.reader.snapshot_path('second@cisco.com'))
+        self.assertEqual([10], list(self.reader.get('first@cisco.com').cssm_dataframe()['inUse']))
+        self.assertEqual([20], list(self.reader.get('second@cisco.com').cssm_dataframe()['inUse']))
+        self.assertIs(self.reader.get('first@cisco.com'), self.reader.get('first@cisco.com'))
+
+    def test_only_the_parsers_of_the_last_users_are_kept(self):
+        reader = LicenseStore(self.snapshot_dir, maxsize=2)
+        for email in ('first@cisco.com', 'second@cisco.com', 'third@cisco.com'):
+            self.writer.refresh(email, account_list())
+        first = reader.get('first@cisco.com')
+        second = reader.get('second@cisco.com')
+
+        self.assertIs(first, reader.get('first@cisco.com'))
+        reader.get('third@cisco.com')
+
+        # second was used last before third came in
+        self.assertIs(first, reader.get('first@cisco.com'))
+        self.assertIsNot(second, reader.get('second@cisco.com'))
+        self.assertEqual([10], list(reader.get('second@cisco.com').cssm_dataframe()['inUse']))
+
+    def test_removed_snapshot(self):
+        self.writer.refresh('user@cisco.com', account_list())
+        self.assertIsNotNone(self.reader.get('user@cisco.com'))
+
+        os.remove(self.reader.snapshot_path('user@cisco.com'))
+
+        self.assertIsNone(self.reader.get('user@cisco.com'))
+
+    def test_refresh_reuses_the_snapshot(self):
+        self.writer.refresh('user@cisco.com', account_list(in_use=10))
+
+        parser = self.reader.refresh('user@cisco.com', account_list(in_use=20))
+
+        expected = cssm_parser.CSSMJSONParser(account_list(in_use=20)).cssm_dataframe()
+        pd.testing.assert_frame_equal(expected, parser.cssm_dataframe())
+        self.assertIs(parser, self.reader.get('user@cisco.com'))
+        self.assertEqual([20], list(self.writer.get('user@cisco.com').cssm_dataframe()['inUse']))
+
+    def test_unreadable_snapshot(self):
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        with open(self.reader.snapshot_path('user@cisco.com'), 'wb') as fp:
+            fp.write(b'not an arrow file')
+
+        self.assertIsNone(self.reader.get('user@cisco.com'))
+
+
+if __name__ == '__main__':
+    unittest.main()
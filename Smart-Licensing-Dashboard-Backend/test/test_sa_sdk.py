@@ -0,0 +1,200 @@
+"""
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.0 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+
+"""
+
+import unittest
+import json
+import threading
+from unittest import mock
+import sa_sdk
+
+__author__ = "Tim Taylor <timtayl@cisco.com>"
+__contributors__ = ["William Kurkian <wkurkian@cisco.com>"]
+__copyright__ = "Copyright (c) 2019 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.0"
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, json_body=None, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.__json_body = json_body
+
+    def json(self):
+        return self.__json_body
+
+    def close(self):
+        pass
+
+
+class FakeCSSM(object):
+    """ answers the licenses API from a list of licenses.  total_records lets a test report a stale count."""
+    def __init__(self, license_count, total_records=None):
+        self.licenses = [{'license': 'License {}'.format(i), 'virtualAccount': 'VA', 'quantity': 1, 'inUse': 0}
+                         for i in range(license_count)]
+        self.total_records = license_count if total_records is None else total_records
+        self.offsets = []
+        self.__lock = threading.Lock()
+
+    def request(self, method, uri, **kwargs):
+        body = json.loads(kwargs['data'])
+        with self.__lock:
+            self.offsets.append(body['offset'])
+        page = self.licenses[body['offset']:body['offset'] + body['limit']]
+        return FakeResponse(200, {'licenses': page, 'totalRecords': self.total_records})
+
+
+class SmartAccountSDKPaginationTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(sa_sdk.cssm_rate_limiter, 'acquire')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def list_licenses(self, cssm, max_workers, page_size=10):
+        smart_account = sa_sdk.SmartAccountSDK('apx.cisco.com', 'token', page_size=page_size, max_workers=max_workers)
+        with mock.patch.object(sa_sdk.http_client, 'request', side_effect=cssm.request):
+            return smart_account.list_licenses('example.com', [])
+
+    def test_serial_pages_are_merged_in_order(self):
+        cssm = FakeCSSM(35)
+
+        request_successful, status_code, response_json = self.list_licenses(cssm, max_workers=1)
+
+        self.assertTrue(request_successful)
+        self.assertEqual(cssm.licenses, response_json['licenses'])
+        self.assertEqual([0, 10, 20, 30], cssm.offsets)
+
+    def test_concurrent_pages_are_merged_in_order(self):
+        cssm = FakeCSSM(35)
+
+        request_successful, status_code, response_json = self.list_licenses(cssm, max_workers=4)
+
+        self.assertTrue(request_successful)
+        self.assertEqual(cssm.licenses, response_json['licenses'])
+        self.assertEqual([0, 10, 20, 30], sorted(cssm.offsets))
+
+    def test_pages_past_a_stale_total_are_followed(self):
+        # licenses were added after the first page reported totalRecords
+        for max_workers in (1, 4):
+            cssm = FakeCSSM(47, total_records=25)
+
+            request_successful, status_code, response_json = self.list_licenses(cssm, max_workers=max_workers)
+
+            self.assertTrue(request_successful)
+            self.assertEqual(cssm.licenses, response_json['licenses'])
+            self.assertEqual([0, 10, 20, 30, 40], sorted(cssm.offsets))
+
+    def test_last_full_page_is_followed(self):
+        cssm = FakeCSSM(20)
+
+        request_successful, status_code, response_json = self.list_licenses(cssm, max_workers=4)
+
+        self.assertEqual(cssm.licenses, response_json['licenses'])
+        self.assertEqual([0, 10, 20], sorted(cssm.offsets))
+
+    def test_failed_page_fails_the_request(self):
+        cssm = FakeCSSM(35)
+
+        def request(method, uri, **kwargs):
+            if json.loads(kwargs['data'])['offset'] == 20:
+                return FakeResponse(403, {})
+            return cssm.request(method, uri, **kwargs)
+
+        smart_account = sa_sdk.SmartAccountSDK('apx.cisco.com', 'token', page_size=10, max_workers=4)
+        with mock.patch.object(sa_sdk.http_client, 'request', side_effect=request):
+            request_successful, status_code, response_json = smart_account.list_licenses('example.com', [])
+
+        self.assertFalse(request_successful)
+        self.assertEqual(403, status_code)
+        self.assertIsNone(response_json)
+
+
+class CSSMRequestRetryTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(sa_sdk.cssm_rate_limiter, 'acquire')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.smart_account = sa_sdk.SmartAccountSDK('apx.cisco.com', 'token')
+
+    def test_throttled_request_is_retried_after_retry_after(self):
+        responses = [FakeResponse(429, headers={'Retry-After': '3'}), FakeResponse(200, {'accounts': []})]
+
+        with mock.patch.object(sa_sdk.http_client, 'request', side_effect=responses) as request, \
+                mock.patch.object(sa_sdk.time, 'sleep') as sleep:
+            response = self.smart_account.cssm_request('GET', 'https://apx.cisco.com/')
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(2, request.call_count)
+        sleep.assert_called_once_with(3.0)
+
+    def test_retry_after_is_capped(self):
+        self.assertEqual(sa_sdk.BACKOFF_MAX, sa_sdk.retry_delay(0, '86400'))
+        self.assertEqual(sa_sdk.BACKOFF_MAX, sa_sdk.retry_delay(0, 'Wed, 21 Oct 2099 07:28:00 GMT'))
+
+    def test_request_slot_is_released_during_the_backoff(self):
+        request_slots = threading.BoundedSemaphore(1)
+        responses = [FakeResponse(503), FakeResponse(200, {})]
+
+        def sleep(delay):
+            # another worker can take the slot while this one backs off
+            self.assertTrue(request_slots.acquire(blocking=False))
+            request_slots.release()
+
+        with mock.patch.object(sa_sdk.http_client, 'request', side_effect=responses), \
+                mock.patch.object(sa_sdk.time, 'sleep', side_effect=sleep) as backoff:
+            response = self.smart_account.cssm_request('GET', 'https://apx.cisco.com/', request_slots=request_slots)
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(1, backoff.call_count)
+        self.assertTrue(request_slots.acquire(blocking=False))
+
+    def test_gives_up_after_max_retries(self):
+        with mock.patch.object(sa_sdk.http_client, 'request', return_value=FakeResponse(429)) as request, \
+                mock.patch.object(sa_sdk.time, 'sleep'):
+            response = self.smart_account.cssm_request('GET', 'https://apx.cisco.com/')
+
+        self.assertEqual(429, response.status_code)
+        self.assertEqual(sa_sdk.MAX_RETRIES + 1, request.call_count)
+
+
+class TokenBucketTest(unittest.TestCase):
+    def test_burst_then_refill(self):
+        with mock.patch.object(sa_sdk.time, 'monotonic', return_value=100.0) as monotonic:
+            bucket = sa_sdk.TokenBucket(rate=2, capacity=3)
+
+            self.assertEqual([0.0, 0.0, 0.0], [bucket.reserve() for _ in range(3)])
+            # the bucket is empty, the next callers queue up half a second apart
+            self.assertEqual(0.5, bucket.reserve())
+            self.assertEqual(1.0, bucket.reserve())
+
+            # two seconds refill four tokens, which pays back the two borrowed ones and leaves two
+            monotonic.return_value = 102.0
+            self.assertEqual([0.0, 0.0], [bucket.reserve() for _ in range(2)])
+            self.assertEqual(0.5, bucket.reserve())
+
+    def test_refill_is_capped_at_capacity(self):
+        with mock.patch.object(sa_sdk.time, 'monotonic', return_value=100.0) as monotonic:
+            bucket = sa_sdk.TokenBucket(rate=2, capacity=3)
+
+            monotonic.return_value = 1000.0
+            self.assertEqual([0.0, 0.0, 0.0], [bucket.reserve() for _ in range(3)])
+            self.assertEqual(0.5, bucket.reserve())
+
+
+if __name__ == '__main__':
+    unittest.main()
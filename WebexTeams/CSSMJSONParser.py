@@ -17,10 +17,18 @@ or implied.
 
 """
 
-import pandas as pd
+from lazy_import import lazy_module
 import CSSMLicense
 from loguru import logger
 import functools
+import itertools
+import json
+import operator
+import os
+import tempfile
+
+np = lazy_module('numpy')
+pd = lazy_module('pandas')
 
 
 __author__ = "Tim Taylor <timtayl@cisco.com>"
@@ -48,6 +56,305 @@ def logger_wraps(*, entry=True, exit=True, level="DEBUG"):
 
     return wrapper
 
+# we are only interested, at least at this time, in the following roles.
+# "Appended VA USER" is a faux user created by the SmartAccountSDK due to some wonkiness in how
+# the BU Production Test domain is acting.
+LICENSE_ROLES = ['Virtual Account Administrator', 'Virtual Account User', 'APPENDED VA USER']
+
+
+# the date columns of the licenseDetails and the two formats CSSM sends them in.  i.e. '2019-01-18T01:07:36Z' and
+# '2019-05-20'
+DATE_COLUMNS = ['startDate', 'endDate']
+CSSM_DATE_FORMATS = ['%Y-%m-%dT%H:%M:%SZ', '%Y-%m-%d']
+
+
+def convert_license_dates(values):
+    """ converts a whole column of CSSM date strings to datetime64[ns, UTC] in one go.  Each known format gets one
+    vectorized pass over the dates still left, anything else falls back to pandas' format inference."""
+    dates = pd.Series(values, dtype=object)
+    converted = pd.Series(pd.NaT, index=dates.index, dtype='datetime64[ns, UTC]')
+    remaining = dates.notna()
+
+    for date_format in CSSM_DATE_FORMATS:
+        if not remaining.any():
+            break
+        parsed = pd.to_datetime(dates[remaining], format=date_format, utc=True, errors='coerce')
+        converted[parsed.index] = parsed
+        remaining = remaining & converted.isna()
+
+    if remaining.any():
+        converted[remaining] = pd.to_datetime(dates[remaining], utc=True)
+
+    return converted
+
+
+# compact dtypes of the dataframe.  The account, virtual account and license strings repeat on every row, so they are
+# kept as categoricals.  Quantities get the smallest integer type that fits them and the flags are plain bools.
+CATEGORY_COLUMNS = ['accountName', 'accountDomain', 'accountStatus', 'accountType', 'role', 'virtualAccount',
+                    'virtualAccount_status', 'statusMessage', 'license', 'billingType', 'assignedLicenses_status',
+                    'status', 'licenseType']
+INTEGER_COLUMNS = ['assignedLicenses_quantity', 'inUse', 'available', 'pendingQuantity', 'reserved', 'quantity']
+BOOL_COLUMNS = ['ahaApps', 'isPortable']
+
+
+def compact_dtypes(df):
+    """ applies the compact dtypes above to the columns df has.  A column with missing values keeps the dtype pandas
+    gave it, i.e. an integer column with a None is float, a bool column with a None is object."""
+    for name in CATEGORY_COLUMNS:
+        if name in df.columns and df[name].dtype == object:
+            df[name] = df[name].astype('category')
+
+    for name in INTEGER_COLUMNS:
+        if name in df.columns and pd.api.types.is_integer_dtype(df[name]):
+            df[name] = pd.to_numeric(df[name], downcast='integer')
+
+    for name in BOOL_COLUMNS:
+        if name in df.columns and df[name].dtype == object and df[name].notna().all() and \
+                pd.api.types.infer_dtype(df[name], skipna=False) == 'boolean':
+            df[name] = df[name].astype(bool)
+
+    return df
+
+
+def freeze_dataframe(df):
+    """ flags the arrays behind df read-only, so that a consumer of a shared dataframe can't change it for the others by
+    accident.  A write into df raises ValueError.  Filtering, sorting and grouping build new frames and work as
+    usual.
+
+    The arrays a column hands out (Series.values, to_numpy()) are views of its block, flagging them leaves the block
+    writable, so this has to go through the block manager, which is not public API.  On a pandas whose internals
+    don't look as expected df is left writable: that only loses the safety net."""
+    try:
+        block_manager = df._mgr if hasattr(df, '_mgr') else df._data
+        arrays = []
+        for block in block_manager.blocks:
+            values = block.values
+            # numpy blocks, categoricals (codes) and tz aware datetimes (_ndarray, _data in older pandas)
+            arrays.extend([values, getattr(values, '_codes', None), getattr(values, '_ndarray', None),
+                           getattr(values, '_data', None)])
+    except (AttributeError, TypeError) as e:
+        logger.debug('freeze_dataframe: leaving the dataframe writable, unknown pandas internals: {!r}'.format(e))
+        return df
+
+    for array in arrays:
+        if isinstance(array, np.ndarray):
+            array.flags.writeable = False
+    return df
+
+
+def full_account_rows(df):
+    """ "accountName_virtualAccount", the key the dashboard filters virtual accounts on, -> positions of its rows in df.
+    Built from the groups of the two columns rather than by joining their strings row by row.  The position arrays are
+    read-only, the index is shared like the dataframe."""
+    rows_by_full_account = {}
+    if len(df) > 0:
+        groups = df.groupby(['accountName', 'virtualAccount'], observed=True, sort=False)
+        for (accountName, virtualAccount), rows in groups.indices.items():
+            # ('a_b', 'c') and ('a', 'b_c') share a key
+            rows_by_full_account.setdefault('{}_{}'.format(accountName, virtualAccount), []).append(rows)
+
+    index = {}
+    for full_account, rows in rows_by_full_account.items():
+        index[full_account] = np.concatenate(rows) if len(rows) > 1 else rows[0]
+        index[full_account].flags.writeable = False
+    return index
+
+
+# schema metadata key of the license fingerprints in a saved snapshot.  Snapshots with fingerprints of another format
+# have none under this key, refreshing them parses the json in full.
+SNAPSHOT_FINGERPRINTS_KEY = b'sld_license_fingerprints.2'
+
+
+def iter_licenses(json_to_parse):
+    """ yields (account_dict, license_dict) for every license of every role we are interested in.  account_dict holds
+    the account and role columns of the license and is reused between licenses, copy it to keep it."""
+    # Iterate through the accounts
+    for account in json_to_parse:
+        account_dict = {'accountName': account['accountName'],
+                        'accountDomain': account['accountDomain'],
+                        'accountStatus': account['accountStatus'],
+                        'accountType': account['accountType']}
+
+        #Iterate through the "roles"
+        for role_dict in account['roles']:
+            # logger.info('     working on role_dict: {}'.format(role_dict))
+            role = role_dict['role']
+            account_dict['role'] = role
+
+            if role in LICENSE_ROLES:
+                account_dict['virtualAccount'] = role_dict['virtualAccount']
+                account_dict['virtualAccount_status'] = ""
+                account_dict['statusMessage'] = ""
+                licenses_array = []
+
+                # There will be "assigned licenses" or licenses.  Choose which one we have run into.
+                if 'assignedLicenses' not in role_dict.keys():
+                    # Check to see if there are issues.
+                    if 'licenses' not in role_dict.keys():
+                        logger.error('No licenses or assignedLicenses found!!')
+                        continue
+                    licenses_array = role_dict['licenses']
+                    logger.success('Licenses found!!')
+                else:
+                    logger.success('assignedLicenses found!!')
+                    licenses_array = role_dict['assignedLicenses']['licenses']
+                    account_dict['virtualAccount_status'] = role_dict['assignedLicenses']['status']
+                    account_dict['statusMessage'] = role_dict['assignedLicenses']['statusMessage']
+
+                # work through the array of licenses
+                for license_dict in licenses_array:
+                    yield account_dict, license_dict
+
+
+def attach_licenses(account, domain_licenses):
+    """ sorts the licenses of a domain by virtual account and attaches them to the roles of account"""
+    va_dict = {}
+    # Sort licenses into lists and  put them into dictionary with key = virtualAccount
+    for lic in domain_licenses:
+        if lic["virtualAccount"] not in va_dict.keys():
+            va_dict.update({lic["virtualAccount"]: [lic]})
+        else:
+            va_dict[lic["virtualAccount"]].append(lic)
+
+    reconcile_roles(account, va_dict)
+
+
+def reconcile_roles(account, va_dict):
+    """ attaches each virtual account's licenses to its role.  Virtual accounts that have licenses but no role
+    for this user get an "APPENDED VA USER" role so that their licenses are not lost."""
+    the_roles = account.get("roles")
+
+    # index the roles by virtual account once, instead of scanning every role for every virtual account.
+    # A user can hold more than one role on the same virtual account, so each entry is a list of roles.
+    roles_by_virtual_account = {}
+    for the_role in the_roles:
+        if "virtualAccount" in the_role:
+            roles_by_virtual_account.setdefault(the_role['virtualAccount'], []).append(the_role)
+
+    appended_virtual_accounts = []
+    for the_virtual_account_key, licenses in va_dict.items():
+        matching_roles = roles_by_virtual_account.get(the_virtual_account_key)
+        if matching_roles:
+            for the_role in matching_roles:
+                the_role.update({"licenses": licenses})
+        else:
+            appended_virtual_accounts.append(the_virtual_account_key)
+            the_roles.append({'role': "APPENDED VA USER", \
+                              "virtualAccount": the_virtual_account_key,
+                              "licenses": licenses})
+
+    logger.info('attached licenses for {} virtual accounts, appended: {}'.format(len(va_dict),
+                                                                               appended_virtual_accounts))
+
+
+def license_key(account_dict, license_dict):
+    return (account_dict['accountName'], account_dict['role'], account_dict['virtualAccount'], license_dict['license'])
+
+
+# license columns and the license json field each one comes from
+LICENSE_INFO_FIELDS = [('license', 'license'),
+                       ('assignedLicenses_quantity', 'quantity'),
+                       ('inUse', 'inUse'),
+                       ('available', 'available'),
+                       ('ahaApps', 'ahaApps'),
+                       ('billingType', 'billingType'),
+                       ('pendingQuantity', 'pendingQuantity'),
+                       ('reserved', 'reserved'),
+                       ('isPortable', 'isPortable'),
+                       ('assignedLicenses_status', 'status')]
+
+license_info = operator.itemgetter(*[field for name, field in LICENSE_INFO_FIELDS])
+
+
+def license_fingerprint(account_dict, license_dict):
+    """ everything that ends up in the rows of a license, used to tell if it changed between refreshes.  One flat tuple
+    of the json values: the number of licenseDetails, the account and role columns, the license columns, then the size,
+    the field names and the values of each licenseDetail.  Building and comparing it costs a fraction of parsing the
+    license, and there is only one object per license for the garbage collector to walk through."""
+    details = license_dict['licenseDetails']
+    return tuple(itertools.chain((len(details),), account_dict.values(), license_info(license_dict),
+                                 map(len, details), itertools.chain.from_iterable(details),
+                                 itertools.chain.from_iterable(map(dict.values, details))))
+
+
+def decode_fingerprints(the_json):
+    """ [(license_key, fingerprint), ...] saved as json by CSSMJSONParser.save_snapshot(), with the tuples that json
+    turned into lists made tuples again"""
+    return [(tuple(key), tuple(fingerprint)) for key, fingerprint in json.loads(the_json)]
+
+
+class LicenseColumns(object):
+    """
+    Flattens licenses straight into one python list per dataframe column, so the dataframe is built once from columns
+    instead of from a list of row dicts.
+
+    There is one row per licenseDetail.  The account and license columns are the same for all the details of a
+    license, so they are extended once per license.  The licenseDetails fields are copied as they come, any detail
+    field CSSM adds shows up as a column, the same way it did with row dicts.  The dates are kept as strings until
+    to_dataframe() converts each date column in one vectorized pass, then the columns get their compact dtypes.
+    """
+    def __init__(self):
+        self.columns = {}
+        self.length = 0
+
+    def __column(self, name, row):
+        """ the column name, padded with None up to row, where the next value goes"""
+        column = self.columns.get(name)
+        if column is None:
+            # a column seen for the first time is empty for the rows before it
+            column = self.columns[name] = [None] * row
+        elif len(column) < row:
+            # and so is a column the rows since its last value did not have
+            column.extend([None] * (row - len(column)))
+        return column
+
+    def add_license(self, account_dict, license_dict):
+        details = license_dict['licenseDetails']
+        detail_count = len(details)
+        if detail_count == 0:
+            return
+
+        for name, value in account_dict.items():
+            self.__column(name, self.length).extend([value] * detail_count)
+        for name, field in LICENSE_INFO_FIELDS:
+            self.__column(name, self.length).extend([license_dict[field]] * detail_count)
+
+        # Each license could have multiple instances.  i.e. quantities purchase at different times
+        # iterate through them
+        for row, license_detail in enumerate(details, self.length):
+            for name, value in license_detail.items():
+                self.__column(name, row).append(value)
+
+        self.length += detail_count
+        # pad the columns this license did not have, or not for its last details
+        for column in self.columns.values():
+            if len(column) < self.length:
+                column.extend([None] * (self.length - len(column)))
+
+    def to_dataframe(self, columns=None):
+        for name in DATE_COLUMNS:
+            if name in self.columns:
+                self.columns[name] = convert_license_dates(self.columns[name])
+
+        df = compact_dtypes(pd.DataFrame(self.columns))
+        if columns is not None:
+            df = df.reindex(columns=columns)
+        return df
+
+
+def add_account_licenses(license_columns, account, licenses):
+    """ adds the licenses of one account of a license stream, see CSSMJSONParser.convert_license_stream_to_dataframe.
+
+    The licenses are attached to a copy of the account's roles the same way SmartAccountSDK attaches them, so the rows
+    are those of the parsed json: the licenses of a virtual account show up under every role the user holds on it,
+    and as an "APPENDED VA USER" only if the user holds none."""
+    account = dict(account, roles=[{key: value for key, value in role_dict.items() if key != 'licenses'}
+                                   for role_dict in account['roles']])
+    attach_licenses(account, licenses)
+    for account_dict, license_dict in iter_licenses([account]):
+        license_columns.add_license(account_dict, license_dict)
+
+
 """
 The main mission in life for this object is to take an array of json from the SmartAccountSDK and parse it into a Pandas
 dataframe.  Putting the info into a dataframe allows us to slice and dice potentially large data sets with high
@@ -55,19 +362,37 @@ and relatively little effort.
 
 Most of the instance variable are loaded lazily.
 
+Parsing leaves the json it is given untouched, so the same json can be parsed again or shared.  The dataframe of a
+parser is read-only and is shared as is by every CSSMLicense built on it, i.e. by the endpoints and bot commands that
+use the same cached parser, without copies.
+
 Functions that use this object will initialize it with the json array from SmartAccountSDK and then get the CSSMLicense
-object
+object.  Alternatively it can be initialized with license_stream, the (account, licenses iterator) pairs from
+SmartAccountSDK.stream_all_licenses(), to build the dataframe while the licenses are still being downloaded.
+
+save_snapshot() writes the dataframe, with its dtypes and the license fingerprints, to an Arrow IPC (Feather v2) file.
+load_snapshot() memory-maps such a file back into a parser, so a cached snapshot can be used or refreshed without
+parsing any json or converting any dates.
+
+For users with many Smart Accounts, cssm_dataframe_chunks() yields one dataframe per account instead of the whole
+dataframe, and cssm_license_chunks() aggregates shortage, usage and expiry over those chunks.  Only one account is
+held in memory at a time.  json_to_parse can then be any iterable of accounts, i.e. a generator.
 """
 
 class CSSMJSONParser(object):
     @logger_wraps()
-    def __init__(self, json_to_parse=""):
+    def __init__(self, json_to_parse="", license_stream=None):
         logger.info('CSSMJSONParser, init start')
         self.json_to_parse = json_to_parse
+        self.license_stream = license_stream
         # logger.debug('   json to parse type: {}'.format(type(json_to_parse)))
         # logger.debug('   json to parse: {}'.format(json_to_parse))
         self.__cssm_license = None
         self.__cssm_dataframe = None
+        self.__cssm_unique_dataframe = None
+        self.__full_account_rows = None
+        self.__license_fingerprints = None
+        self.__snapshot_fingerprints = None
         logger.info('CSSMJSONParser, init end')
 
     @logger_wraps()
@@ -75,118 +400,224 @@ class CSSMJSONParser(object):
         logger.info('CSSMJSONParser, cssm_dataframe start')
         if self.__cssm_dataframe is None:
             logger.info('   self.__cssm_dataframe doesnt exist, creating')
-            self.__cssm_dataframe = self.convert_json_to_dataframe()
+            if self.license_stream is not None:
+                self.__cssm_dataframe = self.convert_license_stream_to_dataframe()
+            else:
+                self.__cssm_dataframe = self.convert_json_to_dataframe()
+            # the dataframe is shared by every CSSMLicense built on this parser, possibly from several threads
+            freeze_dataframe(self.__cssm_dataframe)
+            self.__full_account_rows = full_account_rows(self.__cssm_dataframe)
         logger.info('CSSMJSONParser, cssm_dataframe end')
         return self.__cssm_dataframe
 
+    @logger_wraps()
+    def cssm_unique_dataframe(self):
+        """ cssm_dataframe() with one row per license detail, see CSSMLicense.unique_licenses.  Deduplicated once per
+        parse and shared read-only by every CSSMLicense built on this parser."""
+        if self.__cssm_unique_dataframe is None:
+            self.__cssm_unique_dataframe = freeze_dataframe(CSSMLicense.unique_licenses(self.cssm_dataframe()))
+        return self.__cssm_unique_dataframe
+
+    @logger_wraps()
+    def cssm_full_account_rows(self):
+        """ the full_account_rows index of cssm_dataframe().  Built with the dataframe, when the json is parsed, a
+        snapshot is loaded or a refresh is done, and shared by every CSSMLicense built on this parser."""
+        self.cssm_dataframe()
+        return self.__full_account_rows
+
     @logger_wraps()
     def cssm_license(self):
         if self.__cssm_license is None:
-            self.__cssm_license = CSSMLicense.CSSMLicense(self.cssm_dataframe())
+            self.__cssm_license = CSSMLicense.CSSMLicense(self.cssm_dataframe(), self.cssm_unique_dataframe(),
+                                                          full_account_rows=self.cssm_full_account_rows())
         return self.__cssm_license
 
+    def cssm_dataframe_chunks(self):
+        """ yields one dataframe per Smart Account, from json_to_parse or from license_stream.  Accounts without
+        licenses are skipped.  The chunks are not cached, the accounts are parsed again on every call."""
+        if self.license_stream is not None:
+            accounts = self.license_stream
+        else:
+            accounts = ((account, None) for account in self.json_to_parse)
+
+        for account, licenses in accounts:
+            license_columns = LicenseColumns()
+            if licenses is None:
+                for account_dict, license_dict in iter_licenses([account]):
+                    license_columns.add_license(account_dict, license_dict)
+            else:
+                add_account_licenses(license_columns, account, licenses)
+
+            if license_columns.length > 0:
+                yield license_columns.to_dataframe()
+
+    @logger_wraps()
+    def cssm_license_chunks(self, expiration_days=30):
+        return CSSMLicense.CSSMLicenseChunks(self.cssm_dataframe_chunks(), expiration_days=expiration_days)
+
     # where the real magic happens
     @logger_wraps()
     def convert_json_to_dataframe(self):
 
-        license_list = []
-        # Iterate through the accounts
-        for account in self.json_to_parse:
-            accountName = account['accountName']
-            accountDomain = account['accountDomain']
-            accountStatus = account['accountStatus']
-            accountType = account['accountType']
-
-            account_dict = {'accountName': account['accountName'],
-                            'accountDomain': account['accountDomain'],
-                            'accountStatus': account['accountStatus'],
-                            'accountType': account['accountType']}
-
-            #Iterate through the "roles"
-            for role_dict in account['roles']:
-                # logger.info('     working on role_dict: {}'.format(role_dict))
-                role = role_dict['role']
-                account_dict['role'] = role
-
-                # we are only interested, at least at this time, in the following roles.
-                # "Appended VA USER" is a faux user created by the SmartAccountSDK due to some wonkiness in how
-                # the BU Production Test domain is acting.
-                if role in ['Virtual Account Administrator', 'Virtual Account User', 'APPENDED VA USER']:
-                    account_dict['virtualAccount'] = role_dict['virtualAccount']
-                    account_dict['virtualAccount_status'] = ""
-                    account_dict['statusMessage'] = ""
-                    licenses_array = []
-
-                    # There will be "assigned licenses" or licenses.  Choose which one we have run into.
-                    if 'assignedLicenses' not in role_dict.keys():
-                        # Check to see if there are issues.
-                        if 'licenses' not in role_dict.keys():
-                            logger.error('No licenses or assignedLicenses found!!')
-                            continue
-                        licenses_array = role_dict['licenses']
-                        logger.success('Licenses found!!')
-                    else:
-                        logger.success('assignedLicenses found!!')
-                        licenses_array = role_dict['assignedLicenses']['licenses']
-                        account_dict['virtualAccount_status'] = role_dict['assignedLicenses']['status']
-                        account_dict['statusMessage'] = role_dict['assignedLicenses']['statusMessage']
-
-                    license_info_dict = {}
-                    account_dict_copy = {}
-
-                    # work through the array of licenses
-                    for license_dict in licenses_array:
-                        # logger.info('         working on license_dict: {}'.format(license_dict))
-                        license_info_dict['license'] = license_dict['license']
-                        license_info_dict['assignedLicenses_quantity'] = license_dict['quantity']
-                        license_info_dict['inUse'] = license_dict['inUse']
-                        license_info_dict['available'] = license_dict['available']
-                        license_info_dict['ahaApps'] = license_dict['ahaApps']
-                        license_info_dict['billingType'] = license_dict['billingType']
-                        license_info_dict['pendingQuantity'] = license_dict['pendingQuantity']
-                        license_info_dict['reserved'] = license_dict['reserved']
-                        license_info_dict['isPortable'] = license_dict['isPortable']
-                        license_info_dict['assignedLicenses_status'] = license_dict['status']
-
-                        license_info_dict_copy = license_info_dict.copy()
-                        license_detail_dict = {}
-
-                        # Each license could have multiple instances.  i.e. quantities purchase at different times
-                        # iterate through them
-                        for license_detail in license_dict['licenseDetails']:
-                            # logger.info('             working on license_detail: {}'.format(license_detail))
-                            if type(license_detail['startDate']) is not type(None):
-                                if 'Z' in license_detail['startDate']:
-                                    license_detail['startDate'] = \
-                                        pd.to_datetime(license_detail['startDate'], format='%m/%d/%y %H:%M',
-                                                       infer_datetime_format=True,
-                                                       utc=True).to_pydatetime()
-                                else:
-                                    license_detail['startDate'] = \
-                                        pd.to_datetime(license_detail['startDate'],
-                                                       infer_datetime_format=True, utc=True).to_pydatetime()
-                            if type(license_detail['endDate']) is not type(None):
-                                if 'Z' in license_detail['endDate']:
-                                    license_detail['endDate'] = \
-                                        pd.to_datetime(license_detail['endDate'], format='%m/%d/%y %H:%M',
-                                                       infer_datetime_format=True,
-                                                       utc=True).to_pydatetime()
-                                else:
-                                    license_detail['endDate'] = \
-                                        pd.to_datetime(license_detail['endDate'],
-                                                       infer_datetime_format=True, utc=True).to_pydatetime()
-
-                            # Once we have everything, put into the list of licenses.
-                            # We create a copy of the account dict, because we want rows of data in the dataframe.
-                            # the information gathered earlier in the account_dict is common for all rows associated
-                            # with the account.  i.e. accountName, virtualAccount, etc.
-                            account_dict_copy = account_dict.copy()
-                            account_dict_copy.update(license_info_dict_copy)
-                            account_dict_copy.update(license_detail)
-                            license_list.append(account_dict_copy)
+        license_columns = LicenseColumns()
+        for account_dict, license_dict in iter_licenses(self.json_to_parse):
+            license_columns.add_license(account_dict, license_dict)
 
         # Last but not least, create the Pandas Dataframe.
-        df = pd.DataFrame(license_list)
+        df = license_columns.to_dataframe()
         logger.info('CSSMJSONParser, convert_json_to_dataframe end')
 
         return df
+
+    @logger_wraps()
+    def license_fingerprints(self):
+        """ [(license_key, fingerprint), ...] of the json this dataframe was built from, one per license in the order of
+        the rows.  Computed on first use, parsing leaves json_to_parse as it was.  Empty for a license stream, which is
+        gone once parsed."""
+        self.cssm_dataframe()
+        if self.__license_fingerprints is None:
+            if self.__snapshot_fingerprints is not None:
+                # decoded only by the process that refreshes the snapshot, the ones that just read it never need them
+                license_fingerprints = decode_fingerprints(self.__snapshot_fingerprints)
+                self.__snapshot_fingerprints = None
+            elif self.license_stream is None:
+                license_fingerprints = [(license_key(account_dict, license_dict),
+                                         license_fingerprint(account_dict, license_dict))
+                                        for account_dict, license_dict in iter_licenses(self.json_to_parse)]
+            else:
+                license_fingerprints = []
+            self.__license_fingerprints = license_fingerprints
+        return self.__license_fingerprints
+
+    @logger_wraps()
+    def save_snapshot(self, path):
+        """ writes the dataframe and the license fingerprints to path as an Arrow IPC file.  The file is written next to
+        path and then renamed, so a reader never maps a half written snapshot."""
+        # pyarrow is only needed by the backend, which persists snapshots
+        import pyarrow as pa
+
+        table = pa.Table.from_pandas(self.cssm_dataframe(), preserve_index=False)
+        metadata = dict(table.schema.metadata or {})
+        metadata[SNAPSHOT_FINGERPRINTS_KEY] = json.dumps(self.license_fingerprints()).encode('utf-8')
+        table = table.replace_schema_metadata(metadata)
+
+        # a temp file of its own, two threads or processes can save the same snapshot at once
+        temp_file = tempfile.NamedTemporaryFile(dir=os.path.dirname(path) or '.', prefix=os.path.basename(path) + '.',
+                                                suffix='.tmp', delete=False)
+        try:
+            with temp_file, pa.ipc.new_file(temp_file, table.schema) as writer:
+                writer.write_table(table)
+            os.replace(temp_file.name, path)
+        except BaseException:
+            os.remove(temp_file.name)
+            raise
+
+    @staticmethod
+    @logger_wraps()
+    def load_snapshot(path):
+        """ returns a parser over the snapshot saved at path by save_snapshot().  The file is memory-mapped.  The
+        integer columns and the codes of the categorical ones point straight into it, the rest is copied into this
+        process: the category labels, the bool columns, the date columns (they hold nulls) and the string columns,
+        i.e. subscriptionId, which become python objects.  The license fingerprints are decoded on first use."""
+        import pyarrow as pa
+
+        table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+        df = table.to_pandas(split_blocks=True)
+
+        parser = CSSMJSONParser()
+        parser.__cssm_dataframe = freeze_dataframe(df)
+        parser.__full_account_rows = full_account_rows(df)
+        parser.__snapshot_fingerprints = (table.schema.metadata or {}).get(SNAPSHOT_FINGERPRINTS_KEY, b'[]')
+        return parser
+
+    @logger_wraps()
+    def refresh(self, new_json):
+        """ returns a CSSMJSONParser for new_json that reuses this parser's dataframe.
+
+        Every license of new_json is compared with the licenses of the same account, role, virtual account and license
+        this dataframe was built from.  The rows of a license whose fingerprint is unchanged are taken from the cached
+        dataframe, each cached license is used once, so licenses CSSM sends twice keep their own rows.  Only the
+        licenses that are new or changed (quantities, usage, subscriptions, dates, ...) are parsed again.  The rows
+        come out in the order of new_json, as in a full parse, and the CSSMLicense of the new parser recomputes its
+        aggregates from them on first use.
+
+        The new parser holds the dataframe and the fingerprints only, not new_json, so the caller decides how long the
+        json lives.  Refreshing a parser without fingerprints, i.e. CSSMJSONParser() or one built from a license stream,
+        parses new_json in full.
+        """
+        old_fingerprints = self.license_fingerprints()
+        old_df = self.cssm_dataframe()
+
+        if len(old_df) == 0 or not old_fingerprints:
+            refreshed = CSSMJSONParser(new_json)
+            refreshed.license_fingerprints()
+            refreshed.json_to_parse = ""
+            return refreshed
+
+        # the cached licenses of each key, with the row their details start at
+        old_licenses = {}
+        row = 0
+        for key, fingerprint in old_fingerprints:
+            old_licenses.setdefault(key, []).append((fingerprint, row))
+            row += fingerprint[0]
+
+        new_fingerprints = []
+        changed_columns = LicenseColumns()
+        # the rows of the refreshed dataframe, as positions in old_df followed by the changed rows
+        rows = []
+        for account_dict, license_dict in iter_licenses(new_json):
+            key = license_key(account_dict, license_dict)
+            fingerprint = license_fingerprint(account_dict, license_dict)
+            new_fingerprints.append((key, fingerprint))
+
+            start = None
+            cached_licenses = old_licenses.get(key, [])
+            for position, (old_fingerprint, old_row) in enumerate(cached_licenses):
+                if old_fingerprint == fingerprint:
+                    start = old_row
+                    del cached_licenses[position]
+                    break
+            if start is None:
+                # new licenses count as changed, they have no old fingerprint
+                start = len(old_df) + changed_columns.length
+                changed_columns.add_license(account_dict, license_dict)
+            rows.extend(range(start, start + fingerprint[0]))
+
+        if changed_columns.length > 0:
+            changed_df = changed_columns.to_dataframe()
+            # detail fields CSSM started sending show up as new columns, empty for the kept rows, as in a full parse
+            columns = list(old_df.columns) + [column for column in changed_df.columns if column not in old_df.columns]
+            df = pd.concat([old_df, changed_df], ignore_index=True, sort=False).reindex(columns=columns)
+        else:
+            df = old_df
+        # categoricals with different categories concat to object, compact_dtypes makes them categoricals again
+        df = compact_dtypes(df.take(rows).reset_index(drop=True))
+        for name in df.columns:
+            if df[name].dtype.name == 'category':
+                # the categories of licenses that are gone
+                df[name] = df[name].cat.remove_unused_categories()
+
+        # the cached licenses left over changed or are gone from new_json
+        reused = len(old_fingerprints) - sum(map(len, old_licenses.values()))
+        logger.info('CSSMJSONParser, refresh: {} licenses, {} reused, {} reparsed'.format(
+            len(new_fingerprints), reused, len(new_fingerprints) - reused))
+
+        refreshed = CSSMJSONParser()
+        refreshed.__cssm_dataframe = freeze_dataframe(df)
+        refreshed.__full_account_rows = full_account_rows(df)
+        refreshed.__license_fingerprints = new_fingerprints
+        return refreshed
+
+    @logger_wraps()
+    def convert_license_stream_to_dataframe(self):
+        """ builds the dataframe from a stream of (account, licenses) pairs, where licenses is an iterator of the
+        license dicts of the account, i.e. SmartAccountSDK.stream_all_licenses().  The licenses are decoded while they
+        are downloaded and only the licenses of one account are held at a time, never the whole CSSM response."""
+        license_columns = LicenseColumns()
+        for account, licenses in self.license_stream:
+            add_account_licenses(license_columns, account, licenses)
+
+        df = license_columns.to_dataframe()
+        logger.info('CSSMJSONParser, convert_license_stream_to_dataframe end')
+
+        return df
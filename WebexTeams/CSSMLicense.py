@@ -17,11 +17,18 @@ or implied.
 
 """
 
-import pandas as pd
+from collections import OrderedDict
 from datetime import datetime, timezone, timedelta
+from lazy_import import lazy_module
 from loguru import logger
 import functools
+import inspect
 import json
+import threading
+
+pd = lazy_module('pandas')
+# CSSMJSONParser imports this module
+cssm_parser = lazy_module('CSSMJSONParser')
 
 __author__ = "Tim Taylor <timtayl@cisco.com>"
 __contributors__ = []
@@ -29,16 +36,74 @@ __copyright__ = "Copyright (c) 2019 Cisco and/or its affiliates."
 __license__ = "Cisco Sample Code License, Version 1.0"
 
 """
-This function is meant to be used with Pandas Dataframes to quickly associated an architecture/technology with a 
-particular license
+The technology catalog maps a license name to its architecture_1 and architecture_2.  It is read once per process and
+kept as a table indexed by license name.
+"""
+TECHNOLOGY_CATALOG = './technology_json_v2'
+
+@functools.lru_cache(maxsize=None)
+def technology_catalog(path=TECHNOLOGY_CATALOG):
+    with open(path, 'r') as fp:
+        return pd.DataFrame.from_dict(json.load(fp), orient='index')
+
+
+"""
+This function is meant to be used with Pandas Dataframes to quickly associate an architecture/technology with a
+column of license names.  The catalog is looked up once per distinct license, licenses it doesn't know get "Uncategorized".
+"""
+def license_architecture(licenses, architecture='architecture_1'):
+    architectures = licenses.map(technology_catalog()[architecture]).astype(object)
+    missing = architectures.isnull()
+    for license in licenses[missing].unique():
+        logger.error('   missing architecture for license:  {}'.format(license))
+    return architectures.fillna("Uncategorized")
+
+"""
+A license detail that is in the json twice, i.e. attached by both the domain wide and a virtual account fetch, shows
+up as two rows that agree on these columns.  The shortage and usage requests work on one row per key.
+"""
+LICENSE_UNIQUE_COLUMNS = ['accountName', 'virtualAccount', 'license', 'quantity', 'inUse']
+
+def unique_licenses(df):
+    if len(df.columns) == 0:
+        return df
+    return df.drop_duplicates(subset=[column for column in LICENSE_UNIQUE_COLUMNS if column in df.columns])
+
+
+"""
+Builds the nested dicts the requests return, i.e. accountName -> virtualAccount -> license, in one pass over df instead
+of filtering df again for every account, virtual account and license.  Keys come in the order they first appear in df
+and the rows of a group keep their order.  leaf turns the rows of a group, tuples of their values in columns, into the
+value stored under the last key.
 """
-def license_technology_architecture(technology_dict, row):
-    if row['license'] in technology_dict:
-        architecture_dict = technology_dict[row['license']]
-        return architecture_dict['architecture_1']
-    else:
-        logger.error('   missing architecture for license:  {}'.format(row['license']))
-        return "Uncategorized"
+def nested_license_dict(df, keys, columns, leaf):
+    the_dict = {}
+    groups = []
+    depth = len(keys) - 1
+    for row in zip(*[df[column].tolist() for column in keys + columns]):
+        node = the_dict
+        for key in row[:depth]:
+            node = node.setdefault(key, {})
+
+        rows = node.get(row[depth])
+        if rows is None:
+            rows = node[row[depth]] = []
+            groups.append((node, row[depth]))
+        rows.append(row[depth + 1:])
+
+    for node, key in groups:
+        node[key] = leaf(node[key])
+
+    return the_dict
+
+
+"""
+Quantities are stored in the smallest integer type that fits them.  Totals and differences are computed in int64 so
+they can't overflow.
+"""
+def widen(series):
+    return series.astype('int64') if pd.api.types.is_integer_dtype(series) else series
+
 
 """
 This function is meant to be used with Pandas Dataframes to calculate license utilization
@@ -66,6 +131,68 @@ def logger_wraps(*, entry=True, exit=True, level="DEBUG"):
 
     return wrapper
 
+
+"""
+Memoizes a request per CSSMLicense, keyed by its arguments, i.e. the virtual account filter and expiration_days.  A
+filter is keyed by the set of its names, so the same virtual accounts picked in another order are a hit.  Each
+instance keeps the results of its FILTER_CACHE_SIZE most recently used keys.  The results are shared, callers must not
+change them.
+
+The requests that compare the license dates with now are decorated with by_day=True, which adds the current UTC date to
+the key: a CSSMLicense that lives past midnight, i.e. one shared from a cache, then computes them again.
+"""
+FILTER_CACHE_SIZE = 32
+
+def filter_key(value):
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return frozenset(value)
+    return value
+
+class FilterCache(object):
+    def __init__(self, maxsize=FILTER_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.__results = OrderedDict()
+        # the backend serves the requests of a user from one CSSMLicense on several threads
+        self.__lock = threading.Lock()
+
+    def get(self, key):
+        """ returns (True, result) for a cached key, (False, None) otherwise"""
+        with self.__lock:
+            if key not in self.__results:
+                return False, None
+            self.__results.move_to_end(key)
+            return True, self.__results[key]
+
+    def put(self, key, result):
+        with self.__lock:
+            self.__results[key] = result
+            self.__results.move_to_end(key)
+            while len(self.__results) > self.maxsize:
+                self.__results.popitem(last=False)
+
+def cached_by_filter(func=None, *, by_day=False):
+    if func is None:
+        return functools.partial(cached_by_filter, by_day=by_day)
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapped(self, *args, **kwargs):
+        arguments = signature.bind(self, *args, **kwargs)
+        arguments.apply_defaults()
+        key = (func.__name__,) + tuple(filter_key(value) for name, value in arguments.arguments.items()
+                                       if name != 'self')
+        if by_day:
+            key += (datetime.now(timezone.utc).date(),)
+
+        found, result = self.filter_cache.get(key)
+        if not found:
+            result = func(self, *args, **kwargs)
+            self.filter_cache.put(key, result)
+        return result
+
+    return wrapped
+
+
 """
 This object is where all the magic happens.  It is initialized by a dataframe fed to it from the CSSMJSONParser.
 This object will then use that dataframe to generate dataframes of information for specific requests.  i.e. for 
@@ -83,9 +210,14 @@ The three types of functions are (typically)
 """
 class CSSMLicense(object):
     @logger_wraps()
-    def __init__(self, cssm_dataframe):
+    def __init__(self, cssm_dataframe, unique_dataframe=None, full_account_rows=None):
         self.cssm_dataframe = cssm_dataframe
 
+        self.__unique_dataframe = unique_dataframe
+        self.__full_account_rows = full_account_rows
+        # the results of the requests that take a virtual account filter or expiration_days, see cached_by_filter
+        self.filter_cache = FilterCache()
+
         self.__cssm_virt_accounts_by_accountName = None
         self.__cssm_expired_licenses = None
         self.__account_names = None
@@ -95,6 +227,22 @@ class CSSMLicense(object):
         self.__cssm_license_usage_dict = None
         self.__cssm_top_license_technology_dict = None
 
+    @logger_wraps()
+    def unique_dataframe(self):
+        """ cssm_dataframe without duplicate license details, see unique_licenses.  CSSMJSONParser hands over the one
+        it built at parse time, otherwise it is built here on first use."""
+        if self.__unique_dataframe is None:
+            self.__unique_dataframe = unique_licenses(self.cssm_dataframe)
+        return self.__unique_dataframe
+
+    def full_account_rows(self):
+        """ "accountName_virtualAccount" -> positions of its rows in cssm_dataframe, see
+        CSSMJSONParser.full_account_rows.  CSSMJSONParser hands over the index it built at parse time, otherwise it is
+        built here on first use."""
+        if self.__full_account_rows is None:
+            self.__full_account_rows = cssm_parser.full_account_rows(self.cssm_dataframe)
+        return self.__full_account_rows
+
     @logger_wraps()
     def account_names(self):
         if self.__account_names is None:
@@ -113,43 +261,15 @@ class CSSMLicense(object):
 
     @logger_wraps()
     def cssm_prepare_future_expired_license_dict(self, expired_df):
+        account_dict = nested_license_dict(
+            expired_df, ['accountName', 'virtualAccount', 'license'], ['quantity', 'endDate'],
+            lambda rows: [{'quantity': quantity, 'endDate': endDate.strftime('%Y/%m/%d')}
+                          for quantity, endDate in rows])
 
-        accountNames = expired_df['accountName'].unique()
-        return_dict = {'quantity': len(expired_df)}
-        account_dict = {}
-        for accountName in accountNames:
-
-           virtualAccount_dict = {}
-           virtualAccounts = list(expired_df[expired_df['accountName'] == accountName]['virtualAccount'].unique())
-
-           for virtualAccount in virtualAccounts:
-
-                the_licenses = list(expired_df[expired_df['virtualAccount'] == virtualAccount]['license'].unique())
-
-                virtual_account_df = expired_df[expired_df['virtualAccount'] == virtualAccount]
-                license_dict = {}
-                for license in the_licenses:
-
-                    license_df = virtual_account_df[virtual_account_df['license']==license]
-
-                    details_list = []
-                    for index, row in license_df.iterrows():
-                        details_dict = {'quantity': row['quantity'],
-                                        'endDate': row['endDate'].strftime('%Y/%m/%d')}
-                        details_list.append(details_dict)
-
-                    license_dict[row['license']] = details_list
-
-                virtualAccount_dict[virtualAccount] = license_dict
-
-
-           account_dict[accountName] = virtualAccount_dict
-
-        return_dict['future_expired_licenses'] = account_dict
-
-        return return_dict
+        return {'quantity': len(expired_df), 'future_expired_licenses': account_dict}
 
     @logger_wraps()
+    @cached_by_filter(by_day=True)
     def cssm_top_five_future_expired_licenses(self, expiration_days=180):
         logger.info('expiration days: {}'.format(expiration_days))
 
@@ -160,6 +280,7 @@ class CSSMLicense(object):
         return self.cssm_prepare_future_expired_license_dict(expired_df.head(5))
 
     @logger_wraps()
+    @cached_by_filter(by_day=True)
     def cssm_future_expired_licenses(self, expiration_days=30):
         logger.info('expiration days: {}'.format(expiration_days))
 
@@ -171,23 +292,9 @@ class CSSMLicense(object):
 
     @logger_wraps()
     def cssm_prepare_license_usage_dict(self, usage_df):
-        accountNames = usage_df['accountName'].unique()
-        the_dict = {}
-        for accountName in accountNames:
-            virtualAccount_dict = {}
-            virtualAccounts = list(usage_df[usage_df['accountName'] == accountName]['virtualAccount'].unique())
-
-            for virtualAccount in virtualAccounts:
-
-                license_df = usage_df[usage_df['virtualAccount'] == virtualAccount]
-                license_dict = {}
-                for index, row in license_df.iterrows():
-                    license_dict[row['license']] = {'usage': row['usage']}
-                virtualAccount_dict[virtualAccount] = license_dict
-
-            the_dict[accountName] = virtualAccount_dict
-
-        return the_dict
+        # usage_df is grouped by license, so there is one row per license
+        return nested_license_dict(usage_df, ['accountName', 'virtualAccount', 'license'], ['usage'],
+                                   lambda rows: {'usage': rows[-1][0]})
 
     @logger_wraps()
     def cssm_license_usage_dict(self):
@@ -217,10 +324,10 @@ class CSSMLicense(object):
     @logger_wraps()
     def cssm_license_usage_df(self):
 
-        usage_df = self.cssm_dataframe
+        usage_df = self.unique_dataframe()
 
-        groupd_df = usage_df.groupby(['accountName', 'virtualAccount', 'license'])[
-            'inUse', 'assignedLicenses_quantity'].sum()
+        groupd_df = usage_df.groupby(['accountName', 'virtualAccount', 'license'], observed=True)[
+            ['inUse', 'assignedLicenses_quantity']].sum()
 
         groupd_df['usage'] = license_utilization(groupd_df['inUse'], groupd_df['assignedLicenses_quantity'])
 
@@ -268,39 +375,21 @@ class CSSMLicense(object):
         print(len(technology_df))
         grouped_pct = pd.DataFrame()
         if len(technology_df) > 0:
-            with open('./technology_json_v2', 'r') as fp:
-                technology_dict = json.load(fp)
+            technology_df['architecture_1'] = license_architecture(technology_df['license'])
 
-            technology_df['architecture_1'] = technology_df.apply(
-                lambda row: license_technology_architecture(technology_dict, row), axis=1)
-
-            grouped_df = technology_df.groupby(['accountName', 'architecture_1']).agg(
+            grouped_df = technology_df.groupby(['accountName', 'architecture_1'], observed=True).agg(
                 {'inUse': 'sum'})
-            grouped_pct = grouped_df.groupby(level=0).apply(lambda x:
+            grouped_df['inUse'] = widen(grouped_df['inUse'])
+            grouped_pct = grouped_df.groupby(level=0, observed=True).apply(lambda x:
                                                             100 * x / float(x.sum()))
 
         return grouped_pct.reset_index()
 
     @logger_wraps()
     def cssm_prepare_expired_licenses_dict(self, expired_df):
-        accountNames = expired_df['accountName'].unique()
-        the_dict = {}
-        for accountName in accountNames:
-            virtualAccount_dict = {}
-            virtualAccounts = list(expired_df[expired_df['accountName'] == accountName]['virtualAccount'].unique())
-
-            for virtualAccount in virtualAccounts:
-
-                license_df = expired_df[expired_df['virtualAccount'] == virtualAccount]
-                license_dict = {}
-                for index, row in license_df.iterrows():
-                    license_dict[row['license']] = {'endDate': row['endDate'].strftime('%Y/%m/%d'),
-                                                    'quantity': row['quantity']}
-                virtualAccount_dict[virtualAccount] = license_dict
-
-            the_dict[accountName] = virtualAccount_dict
-
-        return the_dict
+        # the latest expiry of a license wins, expired_df is sorted by endDate
+        return nested_license_dict(expired_df, ['accountName', 'virtualAccount', 'license'], ['endDate', 'quantity'],
+                                   lambda rows: {'endDate': rows[-1][0].strftime('%Y/%m/%d'), 'quantity': rows[-1][1]})
 
     @logger_wraps()
     def cssm_expired_licenses_df(self):
@@ -312,6 +401,7 @@ class CSSMLicense(object):
         return expired_df.sort_values(by=['endDate'], ascending=True)
 
     @logger_wraps()
+    @cached_by_filter(by_day=True)
     def cssm_expired_licenses(self, va_filter_list=[]):
 
         expired_df = self.cssm_expired_licenses_df()
@@ -323,6 +413,7 @@ class CSSMLicense(object):
 
 
     @logger_wraps()
+    @cached_by_filter(by_day=True)
     def cssm_top_five_expired_licenses(self, va_filter_list=[]):
 
             expired_df = self.cssm_expired_licenses_df()
@@ -334,41 +425,23 @@ class CSSMLicense(object):
 
     @logger_wraps()
     def cssm_license_shortage_df(self):
-        df = self.cssm_dataframe.drop_duplicates(subset=['virtualAccount', 'license', 'quantity', 'inUse'])
-        df['shortage']=df['inUse']-df['assignedLicenses_quantity']
-        return df[df['shortage']>0].sort_values('shortage',ascending=False)
+        df = self.unique_dataframe()
+        shortage = widen(df['inUse'])-df['assignedLicenses_quantity']
+        short = shortage>0
+        return df[short].assign(shortage=shortage[short]).sort_values('shortage',ascending=False)
 
     @logger_wraps()
     def cssm_prepare_license_shortage_dict(self, shortage_df):
-
-        accountNames = shortage_df['accountName'].unique()
-        the_dict = {}
-
-        for accountName in accountNames:
-            virtualAccount_dict = {}
-            virtualAccounts = list(shortage_df[shortage_df['accountName'] == accountName]['virtualAccount'].unique())
-
-            for virtualAccount in virtualAccounts:
-                shortage_licenses = shortage_df[shortage_df['virtualAccount'] == virtualAccount]
-                licenses = []
-                for index, row in shortage_licenses.iterrows():
-                    licenses.append({'license': row['license'],
-                                     'quantity': row['assignedLicenses_quantity'],
-                                     'inUse': row['inUse'],
-                                     'shortage': row['shortage']
-                                     })
-                virtualAccount_dict[virtualAccount] = licenses
-
-            the_dict[accountName] = virtualAccount_dict
-
-        return the_dict
+        return nested_license_dict(
+            shortage_df, ['accountName', 'virtualAccount'],
+            ['license', 'assignedLicenses_quantity', 'inUse', 'shortage'],
+            lambda rows: [{'license': license, 'quantity': quantity, 'inUse': inUse, 'shortage': shortage}
+                          for license, quantity, inUse, shortage in rows])
 
     @logger_wraps()
     def cssm_license_shortage(self):
 
        if self.__cssm_license_shortage is None:
-           df = self.cssm_dataframe.drop_duplicates(subset=['virtualAccount', 'license', 'quantity', 'inUse'])
-
            shortage_df = self.cssm_license_shortage_df()
 
            self.__cssm_license_shortage = self.cssm_prepare_license_shortage_dict(shortage_df)
@@ -379,22 +452,109 @@ class CSSMLicense(object):
     def cssm_license_top_five_shortage(self):
 
         if self.__cssm_license_top_five_shortage is None:
-            df = self.cssm_dataframe.drop_duplicates(subset=['virtualAccount', 'license', 'quantity', 'inUse'])
-
             shortage_df = self.cssm_license_shortage_df()
 
             self.__cssm_license_top_five_shortage = self.cssm_prepare_license_shortage_dict(shortage_df.head(5))
 
+        return self.__cssm_license_top_five_shortage
+
     @logger_wraps()
     def cssm_virt_account_by_accountName(self):
         if self.__cssm_virt_accounts_by_accountName is None:
-            df = self.cssm_dataframe
+            df = self.cssm_dataframe[['accountName', 'virtualAccount']].drop_duplicates()
 
-            accountNames = df['accountName'].unique()
-            the_dict = {}
-            for accountName in accountNames:
-                the_dict[accountName] = list(df[df['accountName'] == accountName]['virtualAccount'].unique())
-
-            self.__cssm_virt_accounts_by_accountName = the_dict
+            self.__cssm_virt_accounts_by_accountName = nested_license_dict(
+                df, ['accountName'], ['virtualAccount'], lambda rows: [virtualAccount for virtualAccount, in rows])
 
         return self.__cssm_virt_accounts_by_accountName
+
+
+"""
+CSSMLicenseChunks answers the shortage, usage and expiry requests of CSSMLicense over a sequence of dataframe chunks,
+i.e. CSSMJSONParser.cssm_dataframe_chunks(), without concatenating them into one dataframe.
+
+Each chunk must hold whole Smart Accounts.  The result dicts are keyed by accountName first, so the dicts of the chunks
+are simply merged, and the top five requests keep a running top five.  The chunks are walked once, on first use, and
+each chunk is dropped as soon as it has been summarized.
+"""
+class CSSMLicenseChunks(object):
+    @logger_wraps()
+    def __init__(self, dataframe_chunks, expiration_days=30):
+        self.dataframe_chunks = dataframe_chunks
+        self.expiration_days = expiration_days
+
+        self.__summary = None
+
+    @staticmethod
+    def __top_five(top_df, df, sort_column):
+        if top_df is not None:
+            df = pd.concat([top_df, df.head(5)], sort=False)
+        return df.sort_values(sort_column, ascending=False).head(5)
+
+    @logger_wraps()
+    def __summarize(self):
+        if self.__summary is None:
+            summary = {'shortage': {}, 'top_five_shortage_df': None,
+                       'usage': {}, 'usage_size': 0, 'top_usage_df': None,
+                       'expired': {}, 'future_expired': {}, 'future_expired_quantity': 0}
+
+            for chunk in self.dataframe_chunks:
+                cssm_license = CSSMLicense(chunk)
+
+                shortage_df = cssm_license.cssm_license_shortage_df()
+                summary['shortage'].update(cssm_license.cssm_prepare_license_shortage_dict(shortage_df))
+                summary['top_five_shortage_df'] = self.__top_five(summary['top_five_shortage_df'], shortage_df,
+                                                                  'shortage')
+
+                usage_df = cssm_license.cssm_license_usage_df().sort_values('usage', ascending=False)
+                usage_df = usage_df[(usage_df['usage'] > 0) & (usage_df['assignedLicenses_quantity'] > 0)]
+                summary['usage'].update(cssm_license.cssm_prepare_license_usage_dict(usage_df))
+                summary['usage_size'] += len(usage_df)
+                summary['top_usage_df'] = self.__top_five(summary['top_usage_df'], usage_df, 'usage')
+
+                summary['expired'].update(
+                    cssm_license.cssm_prepare_expired_licenses_dict(cssm_license.cssm_expired_licenses_df()))
+
+                future_expired_df = cssm_license.cssm_future_expired_df(expiration_days=self.expiration_days)
+                summary['future_expired'].update(
+                    cssm_license.cssm_prepare_future_expired_license_dict(future_expired_df)['future_expired_licenses'])
+                summary['future_expired_quantity'] += len(future_expired_df)
+
+            self.__summary = summary
+
+        return self.__summary
+
+    @logger_wraps()
+    def cssm_license_shortage(self):
+        return self.__summarize()['shortage']
+
+    @logger_wraps()
+    def cssm_license_top_five_shortage(self):
+        top_five_df = self.__summarize()['top_five_shortage_df']
+        if top_five_df is None:
+            return {}
+        return CSSMLicense(top_five_df).cssm_prepare_license_shortage_dict(top_five_df)
+
+    @logger_wraps()
+    def cssm_license_usage_dict(self):
+        summary = self.__summarize()
+        if summary['usage_size'] == 0:
+            return {}
+        return {'dict_size': summary['usage_size'], 'usage_dict': summary['usage']}
+
+    @logger_wraps()
+    def cssm_top_license_usage_dict(self):
+        top_usage_df = self.__summarize()['top_usage_df']
+        if top_usage_df is None or len(top_usage_df) == 0:
+            return {}
+        return CSSMLicense(top_usage_df).cssm_prepare_license_usage_dict(top_usage_df)
+
+    @logger_wraps()
+    def cssm_expired_licenses(self):
+        return self.__summarize()['expired']
+
+    @logger_wraps()
+    def cssm_future_expired_licenses(self):
+        summary = self.__summarize()
+        return {'quantity': summary['future_expired_quantity'],
+                'future_expired_licenses': summary['future_expired']}
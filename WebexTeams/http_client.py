@@ -0,0 +1,161 @@
+"""
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.0 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+
+"""
+
+import os
+import random
+import threading
+import requests
+from http.cookiejar import DefaultCookiePolicy
+from loguru import logger
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlparse
+
+__author__ = "Tim Taylor <timtayl@cisco.com>"
+__contributors__ = []
+__copyright__ = "Copyright (c) 2019 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.0"
+
+"""
+Shared HTTP client for every outbound call (apx.cisco.com, api.ciscospark.com, cloudsso.cisco.com, ...).
+
+The module level requests.get/post open a new TCP+TLS connection on every call.  Here we keep one requests.Session
+per host with a keep-alive connection pool, so repeated calls to the same host reuse their connections.  get/post/delete
+take the same arguments as their requests counterparts and add a default timeout.
+
+The sessions are shared by every user and thread, so their cookie jars accept no cookies: a cookie that CSSM or the
+OAuth endpoint sets for one user must never be sent along with the requests of another.
+
+The pool sizes and timeouts can be set with environment variables or with configure().
+
+Wire tracing (request/response headers and the start of the bodies) is off by default.  It can be switched on at start
+up with SLD_HTTP_WIRE_TRACE=1 or at runtime with enable_wire_trace(), for a sample of the calls only if need be.
+"""
+
+# How many connections are kept alive per host.  Should be at least the number of threads talking to one host.
+POOL_MAXSIZE = int(os.environ.get('SLD_HTTP_POOL_MAXSIZE', 16))
+# (connect, read) timeout in seconds applied when the caller does not pass one.
+CONNECT_TIMEOUT = float(os.environ.get('SLD_HTTP_CONNECT_TIMEOUT', 10))
+READ_TIMEOUT = float(os.environ.get('SLD_HTTP_READ_TIMEOUT', 120))
+
+# headers that are never written to the trace
+REDACTED_HEADERS = ('authorization', 'cookie', 'set-cookie')
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+_wire_trace = {'enabled': False, 'sample_rate': 1.0, 'max_body_bytes': 2048}
+_settings = {'pool_maxsize': POOL_MAXSIZE,
+             'timeout': (CONNECT_TIMEOUT, READ_TIMEOUT)}
+
+
+def configure(pool_maxsize=None, timeout=None):
+    """ changes the pool size and/or default timeout.  Existing sessions are closed and rebuilt on next use."""
+    with _sessions_lock:
+        if pool_maxsize is not None:
+            _settings['pool_maxsize'] = pool_maxsize
+        if timeout is not None:
+            _settings['timeout'] = timeout
+
+        for the_session in _sessions.values():
+            the_session.close()
+        _sessions.clear()
+
+
+def enable_wire_trace(sample_rate=1.0, max_body_bytes=2048):
+    """ logs sample_rate (0..1) of the calls, with the bodies cut to max_body_bytes"""
+    _wire_trace.update({'enabled': True, 'sample_rate': sample_rate, 'max_body_bytes': max_body_bytes})
+
+
+def disable_wire_trace():
+    _wire_trace['enabled'] = False
+
+
+def _redact(headers):
+    return {k: ('<redacted>' if k.lower() in REDACTED_HEADERS else v) for k, v in headers.items()}
+
+
+def _truncate(body, max_body_bytes):
+    if body is None:
+        return ''
+    if isinstance(body, str):
+        body = body.encode('utf-8', 'replace')
+    suffix = '... ({} bytes)'.format(len(body)) if len(body) > max_body_bytes else ''
+    return body[:max_body_bytes].decode('utf-8', 'replace') + suffix
+
+
+def _trace_response(response, stream=False, **kwargs):
+    """ requests response hook.  When tracing is off this is a single dict lookup per call."""
+    if not _wire_trace['enabled'] or random.random() >= _wire_trace['sample_rate']:
+        return
+
+    max_body_bytes = _wire_trace['max_body_bytes']
+    request = response.request
+    # streamed bodies are left alone, reading them here would consume them before the caller gets to
+    response_body = '<streamed>' if stream else _truncate(response.content, max_body_bytes)
+    request_body = request.body if not hasattr(request.body, 'read') else '<stream>'
+    logger.debug('wire trace: {} {}\n  request headers: {}\n  request body: {}\n  response {} in {:.3f}s\n'
+                 '  response headers: {}\n  response body: {}'.format(
+                     request.method, request.url, _redact(request.headers), _truncate(request_body, max_body_bytes),
+                     response.status_code, response.elapsed.total_seconds(), _redact(response.headers),
+                     response_body))
+
+
+if os.environ.get('SLD_HTTP_WIRE_TRACE') == '1':
+    enable_wire_trace(float(os.environ.get('SLD_HTTP_WIRE_TRACE_SAMPLE_RATE', 1.0)),
+                      int(os.environ.get('SLD_HTTP_WIRE_TRACE_MAX_BODY', 2048)))
+
+
+def settings():
+    """ returns the current pool size and default timeout, for clients that build their own connection pools"""
+    return dict(_settings)
+
+
+def session(url):
+    """ returns the pooled session for the host of url, creating it the first time the host is seen"""
+    host = urlparse(url).netloc
+    the_session = _sessions.get(host)
+    if the_session is None:
+        with _sessions_lock:
+            the_session = _sessions.get(host)
+            if the_session is None:
+                the_session = requests.Session()
+                the_session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=_settings['pool_maxsize'])
+                the_session.mount('https://', adapter)
+                the_session.mount('http://', adapter)
+                the_session.hooks['response'].append(_trace_response)
+                _sessions[host] = the_session
+
+    return the_session
+
+
+def request(method, url, **kwargs):
+    kwargs.setdefault('timeout', _settings['timeout'])
+    return session(url).request(method, url, **kwargs)
+
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
+
+
+def delete(url, **kwargs):
+    return request('DELETE', url, **kwargs)
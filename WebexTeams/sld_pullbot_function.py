@@ -16,14 +16,12 @@ IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
 or implied.
 
 """
-import requests
+import http_client
 import json
 import datetime as dt
-import CSSMJSONParser as cssm_parser
-import pandas as pd
 import io
 from WBXTeamsBEIntegration import WBXTeamsBEIntegration
-from requests_toolbelt import MultipartEncoder
+from lazy_import import lazy_module
 from loguru import logger
 import functools
 import os
@@ -31,6 +29,12 @@ from cachetools import cached, \
     TTLCache  # 1 - let's import the "cached" decorator and the "TTLCache" object from cachetools
 import threading
 
+# The license analytics pull in pandas, which takes longer to import than the rest of the bot together.  They are
+# imported the first time a license request needs them, so hello/help and a recycled worker start without them.
+cssm_parser = lazy_module('CSSMJSONParser')
+pd = lazy_module('pandas')
+requests_toolbelt = lazy_module('requests_toolbelt')
+
 __author__ = "Tim Taylor <timtayl@cisco.com>"
 __contributors__ = []
 __copyright__ = "Copyright (c) 2019 Cisco and/or its affiliates."
@@ -47,6 +51,10 @@ cssm_url = os.environ.get('CSSM_DOMAIN')
 
 # We cache our data for a few minutes so that subsequent requests from the client do not take too long.
 license_cache = TTLCache(maxsize=100, ttl=300)
+# Once the cached info expires we keep the last parsed licenses of each user (Webex Teams personId) around, so the
+# refresh only reparses what changed.  Keyed by user rather than by cssm token, which changes with every login.  They
+# expire on the license_cache clock, a few of its periods later, so a user who stops asking does not pin them.
+license_snapshots = TTLCache(maxsize=100, ttl=license_cache.ttl * 4)
 
 # for debugging purposes.
 ARE_DEBUGGING=False
@@ -92,7 +100,7 @@ class SmartAccountSDK:
         uri = ("https://" + self.host + call)
         headers = {"Content-Type": "application/json", "Authorization": "Bearer " + self.token}
         logger.info("done preparing request")
-        response = requests.get(uri, headers=headers, verify=True)
+        response = http_client.get(uri, headers=headers, verify=True)
         logger.info("received response")
 
         request_successful = False
@@ -121,7 +129,7 @@ class SmartAccountSDK:
 
         #logger.info('list_licenses json body: \n{}'.format(body))
 
-        response = requests.post(uri, headers=headers, data=json.dumps(body), verify=True)
+        response = http_client.post(uri, headers=headers, data=json.dumps(body), verify=True)
 
         status_code = response.status_code
         request_successful = False
@@ -284,7 +292,7 @@ def retrieve_be_token(be_secret_key, roomId, personId):
 
     # Send the request
     logger.info('    sending request to BE server\n')
-    response = requests.get(token_request_url, json=json.dumps({}), headers=headers)
+    response = http_client.get(token_request_url, json=json.dumps({}), headers=headers)
     logger.info('    received response from BE server\n')
 
     the_token = ""
@@ -323,7 +331,7 @@ def retrieve_be_token(be_secret_key, roomId, personId):
 # We are caching the license information for a few minutes so that response time to the user is faster.
 @logger_wraps()
 @cached(license_cache)
-def get_cssm_license(room_id, bot_token, account_credentials=""):
+def get_cssm_license(room_id, bot_token, account_credentials="", person_id=None):
 
     # Provide feedback to the user that fetching the info will take some time.
     please_wait_message = "Retrieving info from the Cisco Smart Software Manager.  This might take some time."
@@ -347,7 +355,13 @@ def get_cssm_license(room_id, bot_token, account_credentials=""):
         retrieved_all_info_message = "Retrieved all the info from the CSSM Server, just a bit more time to get your request."
         send_processing_status_message(room_id, bot_token, retrieved_all_info_message)
 
-        parser = cssm_parser.CSSMJSONParser(json_array)
+        snapshot = license_snapshots.get(person_id) if person_id is not None else None
+        if snapshot is None:
+            # an empty parser refreshes into a full parse
+            snapshot = cssm_parser.CSSMJSONParser()
+        parser = snapshot.refresh(json_array)
+        if person_id is not None:
+            license_snapshots[person_id] = parser
         cssm_license = parser.cssm_license()
 
 
@@ -519,7 +533,7 @@ def create_license_status_message(cssm_license):
 
 
 @logger_wraps()
-def prepare_license_status_message(room_id, bot_token, account_credentials=""):
+def prepare_license_status_message(room_id, bot_token, account_credentials="", person_id=None):
     request_successful = False
     cssm_license = None
 
@@ -534,7 +548,7 @@ def prepare_license_status_message(room_id, bot_token, account_credentials=""):
         request_successful = True
 
     else:
-        request_successful, cssm_license = get_cssm_license(room_id, bot_token, account_credentials)
+        request_successful, cssm_license = get_cssm_license(room_id, bot_token, account_credentials, person_id=person_id)
 
     if request_successful:
         logger.info('done getting list of licenses')
@@ -549,10 +563,10 @@ def prepare_license_status_message(room_id, bot_token, account_credentials=""):
 # Function called by smartdashpullbot to send an overall status.  This function calls on the prepare and create functions
 # above to get the message to package up and send to webex teams in response to a request.
 @logger_wraps()
-def send_license_status_update(room_id, bot_token, account_credentials):
+def send_license_status_update(room_id, bot_token, account_credentials, person_id=None):
     post_url = "https://api.ciscospark.com/v1/messages"
 
-    post_data = {'roomId': room_id, 'markdown': prepare_license_status_message(room_id, bot_token, account_credentials)}
+    post_data = {'roomId': room_id, 'markdown': prepare_license_status_message(room_id, bot_token, account_credentials, person_id=person_id)}
 
     logger.info('starting post')
     request_response_results = post_request(post_url,
@@ -599,7 +613,7 @@ def create_license_shortages_message(cssm_license):
 
 
 @logger_wraps()
-def prepare_license_shortage_message(room_id, bot_token, account_credentials=""):
+def prepare_license_shortage_message(room_id, bot_token, account_credentials="", person_id=None):
     request_successful = False
     cssm_license = None
     if ARE_DEBUGGING:
@@ -610,7 +624,7 @@ def prepare_license_shortage_message(room_id, bot_token, account_credentials="")
         cssm_license = parser.cssm_license()
         request_successful = True
     else:
-        request_successful, cssm_license = get_cssm_license(room_id, bot_token, account_credentials)
+        request_successful, cssm_license = get_cssm_license(room_id, bot_token, account_credentials, person_id=person_id)
 
     if request_successful:
         logger.info('done getting list of licenses')
@@ -624,10 +638,10 @@ def prepare_license_shortage_message(room_id, bot_token, account_credentials="")
 # Function called by smartdashpullbot to send information on license shortages.  This function calls on the prepare and create functions
 # above to get the message to package up and send to webex teams in response to a request.
 @logger_wraps()
-def send_license_shortage(room_id, bot_token, account_credentials):
+def send_license_shortage(room_id, bot_token, account_credentials, person_id=None):
     post_url = "https://api.ciscospark.com/v1/messages"
 
-    post_data = {'roomId': room_id, 'markdown': prepare_license_shortage_message(room_id, bot_token, account_credentials)}
+    post_data = {'roomId': room_id, 'markdown': prepare_license_shortage_message(room_id, bot_token, account_credentials, person_id=person_id)}
 
     logger.info('starting post')
     request_response_results = post_request(post_url,
@@ -692,7 +706,7 @@ def create_license_usage_message(cssm_license):
 
 
 @logger_wraps()
-def prepare_license_usage_message(room_id, bot_token, account_credentials=""):
+def prepare_license_usage_message(room_id, bot_token, account_credentials="", person_id=None):
     request_successful = False
     cssm_license = None
     if ARE_DEBUGGING:
@@ -703,7 +717,7 @@ def prepare_license_usage_message(room_id, bot_token, account_credentials=""):
         cssm_license = parser.cssm_license()
         request_successful = True
     else:
-        request_successful, cssm_license = get_cssm_license(room_id, bot_token, account_credentials)
+        request_successful, cssm_license = get_cssm_license(room_id, bot_token, account_credentials, person_id=person_id)
 
     should_export_as_excel = False
 
@@ -731,10 +745,10 @@ def license_usage_excel_writer(cssm_df=None):
 # Function called by smartdashpullbot to send license usage info.  This function calls on the prepare and create functions
 # above to get the message to package up and send to webex teams in response to a request.
 @logger_wraps()
-def send_license_usage(room_id, bot_token, account_credentials):
+def send_license_usage(room_id, bot_token, account_credentials, person_id=None):
     post_url = "https://api.ciscospark.com/v1/messages"
 
-    msg, should_export_as_excel = prepare_license_usage_message(room_id, bot_token, account_credentials)
+    msg, should_export_as_excel = prepare_license_usage_message(room_id, bot_token, account_credentials, person_id=person_id)
 
     post_data = {'roomId': room_id,
                  'markdown': msg}
@@ -759,7 +773,7 @@ def send_license_usage(room_id, bot_token, account_credentials):
             cssm_license = parser.cssm_license()
             request_successful = True
         else:
-            request_successful, cssm_license = get_cssm_license(room_id, bot_token, account_credentials)
+            request_successful, cssm_license = get_cssm_license(room_id, bot_token, account_credentials, person_id=person_id)
 
 
         if request_successful:
@@ -771,7 +785,7 @@ def send_license_usage(room_id, bot_token, account_credentials):
                           'files': ('license_usage_export.xlsx', excel_output, filetype)}
 
 
-            message_data = MultipartEncoder(fields=my_fields1)
+            message_data = requests_toolbelt.MultipartEncoder(fields=my_fields1)
 
             logger.info('starting post')
             request_response_results = post_request(post_url,
@@ -809,7 +823,7 @@ def create_license_architecture_mix_message(cssm_license):
 
 
 @logger_wraps()
-def prepare_license_architecture_mix_message(room_id, bot_token, account_credentials="", expiration_days=30):
+def prepare_license_architecture_mix_message(room_id, bot_token, account_credentials="", expiration_days=30, person_id=None):
     request_successful = False
     cssm_license = None
     if ARE_DEBUGGING:
@@ -820,7 +834,7 @@ def prepare_license_architecture_mix_message(room_id, bot_token, account_credent
         cssm_license = parser.cssm_license()
         request_successful = True
     else:
-        request_successful, cssm_license = get_cssm_license(room_id, bot_token, account_credentials)
+        request_successful, cssm_license = get_cssm_license(room_id, bot_token, account_credentials, person_id=person_id)
 
     if request_successful:
         logger.info('done getting list of licenses')
@@ -833,12 +847,12 @@ def prepare_license_architecture_mix_message(room_id, bot_token, account_credent
 # Function called by smartdashpullbot to send architecture mix info.  This function calls on the prepare and create functions
 # above to get the message to package up and send to webex teams in response to a request.
 @logger_wraps()
-def send_license_architecture_mix(room_id, bot_token, account_credentials):
+def send_license_architecture_mix(room_id, bot_token, account_credentials, person_id=None):
 
     post_url = "https://api.ciscospark.com/v1/messages"
 
     post_data = {'roomId': room_id,
-                 'markdown': prepare_license_architecture_mix_message(room_id, bot_token, account_credentials)}
+                 'markdown': prepare_license_architecture_mix_message(room_id, bot_token, account_credentials, person_id=person_id)}
 
     logger.info('starting post')
     request_response_results = post_request(post_url,
@@ -900,7 +914,7 @@ def create_future_expired_licenses_message(cssm_license, expiration_days=30):
     return msg.format(expiration_days)
 
 @logger_wraps()
-def prepare_future_expired_licenses_message(room_id, bot_token, account_credentials="", expiration_days=30):
+def prepare_future_expired_licenses_message(room_id, bot_token, account_credentials="", expiration_days=30, person_id=None):
     request_successful = False
     cssm_license = None
     if ARE_DEBUGGING:
@@ -911,7 +925,7 @@ def prepare_future_expired_licenses_message(room_id, bot_token, account_credenti
         cssm_license = parser.cssm_license()
         request_successful = True
     else:
-        request_successful, cssm_license = get_cssm_license(room_id, bot_token, account_credentials)
+        request_successful, cssm_license = get_cssm_license(room_id, bot_token, account_credentials, person_id=person_id)
 
     if request_successful:
         logger.info('done getting list of licenses')
@@ -925,13 +939,13 @@ def prepare_future_expired_licenses_message(room_id, bot_token, account_credenti
 # This function calls on the prepare and create functions above to get the message to package up and send to webex
 # teams in response to a request.
 @logger_wraps()
-def send_future_expired_licenses(room_id, bot_token, account_credentials, expiration_days=30):
+def send_future_expired_licenses(room_id, bot_token, account_credentials, expiration_days=30, person_id=None):
     logger.info('send_thirty_expired_licenses start')
 
     post_url = "https://api.ciscospark.com/v1/messages"
 
     post_data = {'roomId': room_id, 'markdown': prepare_future_expired_licenses_message(room_id, bot_token, account_credentials,
-                                                                                        expiration_days=expiration_days)}
+                                                                                        expiration_days=expiration_days, person_id=person_id)}
 
     logger.info('starting post')
     request_response_results = post_request(post_url,
@@ -980,7 +994,7 @@ def create_expired_licenses_message(cssm_license):
 
 
 @logger_wraps()
-def prepare_expired_licenses_message(room_id, bot_token, account_credentials=""):
+def prepare_expired_licenses_message(room_id, bot_token, account_credentials="", person_id=None):
     # For testing only until we can pull data from another source
     request_successful = False
     cssm_license = None
@@ -992,7 +1006,7 @@ def prepare_expired_licenses_message(room_id, bot_token, account_credentials="")
         cssm_license = parser.cssm_license()
         request_successful = True
     else:
-        request_successful, cssm_license = get_cssm_license(room_id, bot_token, account_credentials)
+        request_successful, cssm_license = get_cssm_license(room_id, bot_token, account_credentials, person_id=person_id)
 
     if request_successful:
         logger.info('done getting list of licenses')
@@ -1005,12 +1019,12 @@ def prepare_expired_licenses_message(room_id, bot_token, account_credentials="")
 # Function called by smartdashpullbot to send expired license info.  This function calls on the prepare and create functions
 # above to get the message to package up and send to webex teams in response to a request.
 @logger_wraps()
-def send_expired_licenses(room_id, bot_token, account_credentials):
+def send_expired_licenses(room_id, bot_token, account_credentials, person_id=None):
     logger.info('send_expired_licenses start')
 
     post_url = "https://api.ciscospark.com/v1/messages"
 
-    post_data = {'roomId': room_id, 'markdown': prepare_expired_licenses_message(room_id, bot_token, account_credentials)}
+    post_data = {'roomId': room_id, 'markdown': prepare_expired_licenses_message(room_id, bot_token, account_credentials, person_id=person_id)}
 
     logger.info('starting post')
     request_response_results = post_request(post_url,
@@ -1047,7 +1061,7 @@ def license_excel_writer(cssm_df=None):
 # Function called by smartdashpullbot to send an export of all the license info.  This function calls on the prepare
 # and create functions above to get the message to package up and send to webex teams in response to a request.
 @logger_wraps()
-def send_license_export(room_id, bot_token, account_credentials):
+def send_license_export(room_id, bot_token, account_credentials, person_id=None):
 
     post_url = "https://api.ciscospark.com/v1/messages"
 
@@ -1063,7 +1077,7 @@ def send_license_export(room_id, bot_token, account_credentials):
         cssm_license = parser.cssm_license()
         request_successful = True
     else:
-        request_successful, cssm_license = get_cssm_license(room_id, bot_token, account_credentials)
+        request_successful, cssm_license = get_cssm_license(room_id, bot_token, account_credentials, person_id=person_id)
 
 
     request_response_results = None
@@ -1077,7 +1091,7 @@ def send_license_export(room_id, bot_token, account_credentials):
         my_fields1['files'] = ('license_export.xlsx', excel_output, filetype)
         my_fields1['markdown'] = msg
 
-        message_data = MultipartEncoder(fields=my_fields1)
+        message_data = requests_toolbelt.MultipartEncoder(fields=my_fields1)
 
         logger.info('starting post')
         request_response_results = post_request(post_url,
@@ -1118,7 +1132,7 @@ def create_virtual_accounts_message(cssm_license):
 
 
 @logger_wraps()
-def prepare_virtual_accounts_message(room_id, bot_token, account_credentials=""):
+def prepare_virtual_accounts_message(room_id, bot_token, account_credentials="", person_id=None):
     request_successful = False
     cssm_license = None
     if ARE_DEBUGGING:
@@ -1129,7 +1143,7 @@ def prepare_virtual_accounts_message(room_id, bot_token, account_credentials="")
         cssm_license = parser.cssm_license()
         request_successful = True
     else:
-        request_successful, cssm_license = get_cssm_license(room_id, bot_token, account_credentials)
+        request_successful, cssm_license = get_cssm_license(room_id, bot_token, account_credentials, person_id=person_id)
 
     if request_successful:
         logger.info('done getting list of licenses')
@@ -1141,10 +1155,10 @@ def prepare_virtual_accounts_message(room_id, bot_token, account_credentials="")
 # Function called by smartdashpullbot to send virtual accounts info.  This function calls on the prepare and create functions
 # above to get the message to package up and send to webex teams in response to a request.
 @logger_wraps()
-def send_virtual_accounts(room_id, bot_token, account_credentials):
+def send_virtual_accounts(room_id, bot_token, account_credentials, person_id=None):
     post_url = "https://api.ciscospark.com/v1/messages"
 
-    post_data = {'roomId': room_id, 'markdown': prepare_virtual_accounts_message(room_id, bot_token, account_credentials)}
+    post_data = {'roomId': room_id, 'markdown': prepare_virtual_accounts_message(room_id, bot_token, account_credentials, person_id=person_id)}
 
     logger.info('starting post')
     request_response_results = post_request(post_url,
@@ -1181,7 +1195,7 @@ def create_account_names_message(cssm_license):
 
 
 @logger_wraps()
-def prepare_account_names_message(room_id, bot_token, account_credentials=""):
+def prepare_account_names_message(room_id, bot_token, account_credentials="", person_id=None):
     request_successful = False
     cssm_license = None
     if ARE_DEBUGGING:
@@ -1192,7 +1206,7 @@ def prepare_account_names_message(room_id, bot_token, account_credentials=""):
         cssm_license = parser.cssm_license()
         request_successful = True
     else:
-        request_successful, cssm_license = get_cssm_license(room_id, bot_token, account_credentials)
+        request_successful, cssm_license = get_cssm_license(room_id, bot_token, account_credentials, person_id=person_id)
 
     if request_successful:
         logger.info('done getting list of licenses')
@@ -1207,10 +1221,10 @@ def prepare_account_names_message(room_id, bot_token, account_credentials=""):
 # Function called by smartdashpullbot to send smart account info.  This function calls on the prepare and create functions
 # above to get the message to package up and send to webex teams in response to a request.
 @logger_wraps()
-def send_account_names(room_id, bot_token, account_credentials):
+def send_account_names(room_id, bot_token, account_credentials, person_id=None):
     post_url = "https://api.ciscospark.com/v1/messages"
 
-    post_data = {'roomId': room_id, 'markdown': prepare_account_names_message(room_id, bot_token, account_credentials)}
+    post_data = {'roomId': room_id, 'markdown': prepare_account_names_message(room_id, bot_token, account_credentials, person_id=person_id)}
 
     logger.info('starting post')
     request_response_results = post_request(post_url,
@@ -1333,11 +1347,11 @@ def send_hello_back(room_id, bot_token):
 def post_request(url, post_headers, post_data=None, post_json=None):
     spark_request = None
     if post_data:
-        spark_request = requests.post(url,
+        spark_request = http_client.post(url,
                                       data=post_data,
                                       headers=post_headers)
     elif json:
-        spark_request = requests.post(url, json=post_json, headers=post_headers)
+        spark_request = http_client.post(url, json=post_json, headers=post_headers)
     else:
         return [False, {"error_key": "No json or data payload"}]
 
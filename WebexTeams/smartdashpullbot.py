@@ -18,7 +18,7 @@ or implied.
 """
 from __future__ import absolute_import, division, print_function
 from flask import Flask , request
-import requests
+import http_client
 import json
 import os
 import datetime as dt
@@ -75,7 +75,7 @@ def process_initial_request(message_id):
     the_url = "https://api.ciscospark.com/v1/messages/{0}".format(message_id)
     date_time=dt.datetime.now()
     logger.info(' sending the request for the message')
-    message_response = requests.get(the_url,verify=True,headers={'Authorization': 'Bearer {}'.format(bot_token)})
+    message_response = http_client.get(the_url,verify=True,headers={'Authorization': 'Bearer {}'.format(bot_token)})
     logger.info(' received the response for the message request')
     raw = message_response.text
 
@@ -123,70 +123,70 @@ def process_initial_request(message_id):
                       ("list of accounts" in repr(message_text.lower()))) or
                     ("account names" in repr(message_text.lower()))):
                     logger.info('entering send_accout_names')
-                    sld.send_account_names(room_id, bot_token, cssm_token)
+                    sld.send_account_names(room_id, bot_token, cssm_token, person_id=person_id)
 
                 elif (("list of virtual account names" in repr(message_text.lower()) or
                        ("list of virtual accounts" in repr(message_text.lower()))) or
                       ("virtual accounts" in repr(message_text.lower()))):
                     logger.info('send_virtual_accounts')
-                    sld.send_virtual_accounts(room_id, bot_token, cssm_token)
+                    sld.send_virtual_accounts(room_id, bot_token, cssm_token, person_id=person_id)
 
                 elif ("export of licenses" in repr(message_text.lower())) or ("export license" in repr(message_text.lower())):
                     logger.info('send_license_export')
-                    sld.send_license_export(room_id, bot_token, cssm_token)
+                    sld.send_license_export(room_id, bot_token, cssm_token, person_id=person_id)
 
                 elif ("expired licenses" in repr(message_text.lower())):
                     logger.info('send_expired_licenses')
-                    sld.send_expired_licenses(room_id, bot_token, cssm_token)
+                    sld.send_expired_licenses(room_id, bot_token, cssm_token, person_id=person_id)
 
                 elif ("show me licenses with shortages" in repr(message_text.lower())) or \
                         ("license shortage list" in repr(message_text.lower())) or \
                         ("shortages" in repr(message_text.lower())) or \
                         ("license shortage" in repr(message_text.lower())):
                     logger.info('send_license_shortage')
-                    sld.send_license_shortage(room_id, bot_token, cssm_token)
+                    sld.send_license_shortage(room_id, bot_token, cssm_token, person_id=person_id)
 
                 elif ("show me licenses that expire in 30 days" in repr(message_text.lower())) or \
                         ("expire 30" in repr(message_text.lower())) or \
                         ("expire 30 days" in repr(message_text.lower())):
                     logger.info('expire in 30 days')
-                    sld.send_future_expired_licenses(room_id, bot_token, cssm_token, expiration_days=30)
+                    sld.send_future_expired_licenses(room_id, bot_token, cssm_token, expiration_days=30, person_id=person_id)
 
                 elif ("show me licenses that expire in 60 days" in repr(message_text.lower())) or \
                         ("expire 60" in repr(message_text.lower())) or \
                         ("expire 60 days" in repr(message_text.lower())):
                     logger.info('expire in 60 days')
-                    sld.send_future_expired_licenses(room_id, bot_token, cssm_token, expiration_days=60)
+                    sld.send_future_expired_licenses(room_id, bot_token, cssm_token, expiration_days=60, person_id=person_id)
 
                 elif ("show me licenses that expire in 90 days" in repr(message_text.lower())) or \
                         ("expire 90" in repr(message_text.lower())) or \
                         ("expire 90 days" in repr(message_text.lower())):
                     logger.info('expire in 90 days')
-                    sld.send_future_expired_licenses(room_id, bot_token, cssm_token, expiration_days=90)
+                    sld.send_future_expired_licenses(room_id, bot_token, cssm_token, expiration_days=90, person_id=person_id)
 
                 elif ("show me licenses that expire in 180 days" in repr(message_text.lower())) or \
                         ("expire 180" in repr(message_text.lower())) or \
                         ("expire 180 days" in repr(message_text.lower())):
                     logger.info('expire in 180 days')
-                    sld.send_future_expired_licenses(room_id, bot_token, cssm_token, expiration_days=180)
+                    sld.send_future_expired_licenses(room_id, bot_token, cssm_token, expiration_days=180, person_id=person_id)
 
                 elif ("show me the latest status" in repr(message_text.lower())) or \
                         ("status" in repr(message_text.lower())) or \
                         ("give me a status update" in repr(message_text.lower())):
                     logger.info('status')
-                    sld.send_license_status_update(room_id, bot_token, cssm_token)
+                    sld.send_license_status_update(room_id, bot_token, cssm_token, person_id=person_id)
 
                 elif ('show me license usage'  in repr(message_text.lower())) or \
                         ("license usage" in repr(message_text.lower())) or \
                         ("usage" in repr(message_text.lower())):
                     logger.info('get usage status')
-                    sld.send_license_usage(room_id, bot_token, cssm_token)
+                    sld.send_license_usage(room_id, bot_token, cssm_token, person_id=person_id)
 
                 elif ('show me the architecture mix'  in repr(message_text.lower())) or \
                         ("architecture mix" in repr(message_text.lower())) or \
                         ("architecture" in repr(message_text.lower())):
                     logger.info('architecture mix')
-                    sld.send_license_architecture_mix(room_id, bot_token, cssm_token)
+                    sld.send_license_architecture_mix(room_id, bot_token, cssm_token, person_id=person_id)
 
                 else:
                     logger.info('entering send_problem abck')
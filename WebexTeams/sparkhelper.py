@@ -19,7 +19,7 @@ or implied.
 from __future__ import absolute_import, division, print_function
 
 import datetime as dt
-import requests
+import http_client
 import json
 import hashlib
 import hmac
@@ -57,7 +57,7 @@ def membership_check(room_Id, bot_token, allowed_person_Org_Id):
 
     get_request_headers = {"Authorization": "Bearer {}".format(bot_token)}
 
-    message_response = requests.get(the_url, verify=True, headers=get_request_headers)
+    message_response = http_client.get(the_url, verify=True, headers=get_request_headers)
     if message_response.status_code == 200:
 
         message_json = json.loads(message_response.text)
@@ -72,7 +72,7 @@ def membership_check(room_Id, bot_token, allowed_person_Org_Id):
 
 def check_and_delete_membership(bot_token, allowed_person_Org_Id):
     membership_url = "https://api.ciscospark.com/v1/memberships"
-    membership_message_response = requests.get(membership_url, verify=True, headers={'Authorization': 'Bearer {}'.format(bot_token)})
+    membership_message_response = http_client.get(membership_url, verify=True, headers={'Authorization': 'Bearer {}'.format(bot_token)})
 
     response_json = json.loads(membership_message_response.text)
     print(response_json, membership_message_response.status_code)
@@ -98,7 +98,7 @@ def check_and_delete_membership(bot_token, allowed_person_Org_Id):
         for bad_membership_id in bad_memberships:
             print("   ...deleting membership:  {}".format(bad_membership_id))
             delete_url = "https://api.ciscospark.com/v1/memberships/{}".format(bad_membership_id)
-            delete_message_response = requests.delete(delete_url, verify=True,
+            delete_message_response = http_client.delete(delete_url, verify=True,
                                                headers={'Authorization': 'Bearer {}'.format(bot_token)})
             if delete_message_response.status_code != 204:
                 print("!!!***...unable to delete membership.  Rerun audit to delete")
@@ -19,12 +19,15 @@ or implied.
 
 import unittest
 import json
+import sys
+from unittest import mock
 from WebexTeams import CSSMJSONParser as cssm_parser
 from WebexTeams import CSSMLicense as cssm_license
 import pandas as pd
 import datetime as dt
 from datetime import timezone
 from datetime import timedelta
+from WebexTeams.test.test_cssmjsonparser import small_account_list
 
 __author__ = "Tim Taylor <timtayl@cisco.com>"
 __contributors__ = []
@@ -844,9 +847,65 @@ class CSSMLicensingTests(unittest.TestCase):
                                            'Expected: {}\n Result: {}'.format(expected, result))
 
 
-
-
-
+class CSSMLicenseQueryTests(unittest.TestCase):
+    def test_nested_license_dict_keeps_virtual_accounts_of_accounts_apart(self):
+        df = pd.DataFrame({'accountName': ['SA SME', 'Cisco Sales Enablement', 'SA SME', 'SA SME'],
+                           'virtualAccount': ['DEFAULT', 'DEFAULT', 'AT&T', 'DEFAULT'],
+                           'license': ['ISRV AX 1G', 'ISRV AX 1G', 'ISRV AX 1G', 'DNA Advantage For SDWAN'],
+                           'quantity': [1, 2, 3, 4]})
+
+        result = cssm_license.nested_license_dict(df, ['accountName', 'virtualAccount', 'license'], ['quantity'],
+                                                  lambda rows: [quantity for quantity, in rows])
+
+        self.assertEqual({'SA SME': {'DEFAULT': {'ISRV AX 1G': [1], 'DNA Advantage For SDWAN': [4]},
+                                     'AT&T': {'ISRV AX 1G': [3]}},
+                          'Cisco Sales Enablement': {'DEFAULT': {'ISRV AX 1G': [2]}}}, result)
+        self.assertEqual(['SA SME', 'Cisco Sales Enablement'], list(result))
+
+    def test_top_five_shortage_is_returned(self):
+        result = cssm_parser.CSSMJSONParser(small_account_list()).cssm_license().cssm_license_top_five_shortage()
+
+        expected = {'SA SME': {'AT&T': [{'license': 'DNA Advantage For SDWAN', 'quantity': 200, 'inUse': 250,
+                                         'shortage': 50}]}}
+        self.assertEqual(expected, result)
+
+    def test_filtered_requests_are_cached_per_filter(self):
+        the_license = cssm_parser.CSSMJSONParser(small_account_list()).cssm_license()
+
+        att = the_license.cssm_top_five_expired_licenses(['AT&T'])
+        adaltrin = the_license.cssm_top_five_expired_licenses(['Alex Daltrini (adaltrin)'])
+
+        self.assertEqual(['SA SME'], list(att))
+        self.assertEqual(['Cisco Sales Enablement'], list(adaltrin))
+        self.assertIs(att, the_license.cssm_top_five_expired_licenses(['AT&T']))
+        self.assertIs(the_license.cssm_top_five_expired_licenses(['AT&T', 'Alex Daltrini (adaltrin)']),
+                      the_license.cssm_top_five_expired_licenses(['Alex Daltrini (adaltrin)', 'AT&T']))
+
+    def test_date_dependent_requests_are_cached_per_day(self):
+        the_license = cssm_parser.CSSMJSONParser(small_account_list()).cssm_license()
+        license_module = sys.modules[type(the_license).__module__]
+
+        def frozen_datetime(now):
+            class FrozenDatetime(dt.datetime):
+                @classmethod
+                def now(cls, tz=None):
+                    return now
+            return FrozenDatetime
+
+        # an AT&T subscription ends on 2022-01-17
+        with mock.patch.object(license_module, 'datetime',
+                               frozen_datetime(dt.datetime(2022, 1, 10, 8, tzinfo=timezone.utc))):
+            before = the_license.cssm_future_expired_licenses(expiration_days=30)
+        with mock.patch.object(license_module, 'datetime',
+                               frozen_datetime(dt.datetime(2022, 1, 10, 20, tzinfo=timezone.utc))):
+            same_day = the_license.cssm_future_expired_licenses(expiration_days=30)
+        with mock.patch.object(license_module, 'datetime',
+                               frozen_datetime(dt.datetime(2022, 1, 20, 8, tzinfo=timezone.utc))):
+            after = the_license.cssm_future_expired_licenses(expiration_days=30)
+
+        self.assertEqual(1, before['quantity'])
+        self.assertIs(before, same_day)
+        self.assertEqual(0, after['quantity'])
 
 
 if __name__ == '__main__':
@@ -20,6 +20,12 @@ or implied.
 
 import unittest
 import json
+import copy
+import os
+import subprocess
+import sys
+import tempfile
+import threading
 from WebexTeams import CSSMJSONParser as cssm_parser
 from WebexTeams import CSSMLicense as cssm_license
 import pandas as pd
@@ -36,6 +42,25 @@ def license_utilization(inUse, assignedLicenses_quantity):
     return inUse/assignedLicenses_quantity
 
 
+def small_account_list():
+    return [{'accountType': 'CUSTOMER', 'accountName': 'SA SME', 'accountDomain': 'sasme.cisco.com', 'accountStatus': 'Active',
+             'roles': [{'role': 'Smart Account User'},
+                       {'role': 'Virtual Account Administrator', 'virtualAccount': 'AT&T', 'licenses': [
+                           {'license': 'DNA Advantage For SDWAN', 'reserved': 0, 'billingType': 'PREPAID', 'isPortable': False, 'virtualAccount': 'AT&T', 'ahaApps': False, 'pendingQuantity': 0,
+                            'licenseDetails': [{'startDate': '2019-05-20', 'endDate': '2022-05-19', 'subscriptionId': 'Sub269233', 'status': 'ACTIVE', 'licenseType': 'TERM', 'quantity': 100},
+                                               {'startDate': '2019-01-18T01:07:36Z', 'endDate': '2022-01-17T01:07:36Z', 'subscriptionId': None, 'status': 'ACTIVE', 'licenseType': 'TERM', 'quantity': 100}],
+                            'licenseSubstitutions': [], 'available': 150, 'inUse': 250, 'quantity': 200, 'status': 'In Compliance'}]},
+                       {'role': 'Virtual Account User', 'virtualAccount': 'ATT EE CUSTOMER C', 'licenses': [
+                           {'license': 'ISRV AX 1G', 'reserved': 0, 'billingType': 'PREPAID', 'isPortable': False, 'virtualAccount': 'ATT EE CUSTOMER C', 'ahaApps': False, 'pendingQuantity': 0,
+                            'licenseDetails': [{'startDate': None, 'endDate': None, 'subscriptionId': None, 'status': 'ACTIVE', 'licenseType': 'PERPETUAL', 'quantity': 50}],
+                            'licenseSubstitutions': [], 'available': 50, 'inUse': 10, 'quantity': 50, 'status': 'In Compliance'}]}]},
+            {'accountType': 'CUSTOMER', 'accountName': 'Cisco Sales Enablement', 'accountDomain': 'sales-enablement.cisco.com', 'accountStatus': 'Active',
+             'roles': [{'role': 'Virtual Account Administrator', 'virtualAccount': 'Alex Daltrini (adaltrin)', 'licenses': [
+                           {'license': 'ASAv10 Standard - 1G', 'reserved': 0, 'billingType': 'PREPAID', 'isPortable': True, 'virtualAccount': 'Alex Daltrini (adaltrin)', 'ahaApps': False, 'pendingQuantity': 0,
+                            'licenseDetails': [{'startDate': '2018-05-30', 'endDate': '2019-05-29', 'subscriptionId': None, 'status': 'ACTIVE', 'licenseType': 'TERM', 'quantity': 10}],
+                            'licenseSubstitutions': [], 'available': 10, 'inUse': 0, 'quantity': 10, 'status': 'In Compliance'}]}]}]
+
+
 class CSSMJsonParsingTests(unittest.TestCase):
     def test_CSSMJSONParser_Object_exists(self):
         parser = cssm_parser.CSSMJSONParser()
@@ -116,6 +141,244 @@ class CSSMJsonParsingTests(unittest.TestCase):
 
 
 
+    def test_license_stream_matches_json_dataframe(self):
+        the_list = small_account_list()
+        expected = cssm_parser.CSSMJSONParser(small_account_list()).cssm_dataframe()
+
+        # what SmartAccountSDK.stream_all_licenses() hands over: the account, and an iterator over its licenses
+        license_stream = ((account, iter([lic for role in account['roles'] for lic in role.get('licenses', [])]))
+                          for account in the_list)
+        result = cssm_parser.CSSMJSONParser(license_stream=license_stream).cssm_dataframe()
+
+        pd.testing.assert_frame_equal(expected, result)
+
+    def test_license_stream_attaches_licenses_to_every_role(self):
+        the_list = small_account_list()
+        # a second role on AT&T, and a license of a virtual account the user holds no role on
+        the_list[0]['roles'].insert(2, {'role': 'Virtual Account User', 'virtualAccount': 'AT&T'})
+        orphan_license = copy.deepcopy(the_list[0]['roles'][3]['licenses'][0])
+        orphan_license['virtualAccount'] = 'SDWAN'
+        account_licenses = [[lic for role in account['roles'] for lic in role.get('licenses', [])] + extra
+                            for account, extra in zip(the_list, [[orphan_license], []])]
+
+        # the accounts as list_accounts returns them, before the SDK attaches the licenses to their roles
+        for account in the_list:
+            for role in account['roles']:
+                role.pop('licenses', None)
+        full_list = copy.deepcopy(the_list)
+        for account, licenses in zip(full_list, account_licenses):
+            cssm_parser.attach_licenses(account, licenses)
+        expected = cssm_parser.CSSMJSONParser(full_list).cssm_dataframe()
+
+        license_stream = ((account, iter(licenses)) for account, licenses in zip(the_list, account_licenses))
+        result = cssm_parser.CSSMJSONParser(license_stream=license_stream).cssm_dataframe()
+
+        pd.testing.assert_frame_equal(expected, result)
+        sa_sme = result[result['accountName'] == 'SA SME']
+        self.assertEqual(6, len(sa_sme))
+        self.assertEqual(['Virtual Account Administrator'] * 2 + ['Virtual Account User'] * 2,
+                         list(sa_sme.loc[sa_sme['virtualAccount'] == 'AT&T', 'role']))
+        self.assertEqual(['APPENDED VA USER'], list(sa_sme.loc[sa_sme['virtualAccount'] == 'SDWAN', 'role']))
+        # the streamed accounts are left as they came
+        self.assertNotIn('licenses', the_list[0]['roles'][1])
+
+    def test_detail_field_of_a_later_detail_stays_on_its_row(self):
+        the_list = small_account_list()
+        details = the_list[0]['roles'][1]['licenses'][0]['licenseDetails']
+        # a field the first and last details have, but not the one in between
+        details.insert(0, dict(details[0], renewal='first'))
+        details[1]['usageType'] = 'second'
+        details[2]['renewal'] = 'third'
+
+        df = cssm_parser.CSSMJSONParser(the_list).cssm_dataframe()
+
+        self.assertEqual([None, 'second', None, None, None], list(df['usageType']))
+        self.assertEqual(['first', None, 'third', None, None], list(df['renewal']))
+        self.assertEqual([100, 100, 100, 50, 10], list(df['quantity']))
+
+    def test_detail_field_of_a_later_license_stays_on_its_row(self):
+        the_list = small_account_list()
+        the_list[1]['roles'][0]['licenses'][0]['licenseDetails'][0]['usageType'] = 'last'
+
+        df = cssm_parser.CSSMJSONParser(the_list).cssm_dataframe()
+
+        self.assertEqual([None, None, None, 'last'], list(df['usageType']))
+        self.assertEqual('ASAv10 Standard - 1G', df['license'].iloc[3])
+
+    def test_refresh_matches_full_parse(self):
+        parser = cssm_parser.CSSMJSONParser(small_account_list())
+        parser.cssm_dataframe()
+
+        new_list = small_account_list()
+        new_list[0]['roles'][1]['licenses'][0]['inUse'] = 300
+        del new_list[0]['roles'][2]['licenses'][0]
+        new_list[1]['roles'][0]['licenses'][0]['licenseDetails'][0]['quantity'] = 20
+
+        expected = cssm_parser.CSSMJSONParser(copy.deepcopy(new_list)).cssm_dataframe()
+        result = parser.refresh(new_list).cssm_dataframe()
+
+        self.assertEqual(3, len(result))
+        pd.testing.assert_frame_equal(expected, result)
+
+    def test_refresh_keeps_the_order_of_duplicate_licenses(self):
+        old_list = small_account_list()
+        licenses = old_list[0]['roles'][1]['licenses']
+        # CSSM sends the same license of a virtual account twice, with another license in between
+        other_license = copy.deepcopy(licenses[0])
+        other_license['license'] = 'ISRV AX 1G'
+        licenses.extend([other_license, copy.deepcopy(licenses[0])])
+        licenses[2]['inUse'] = 10
+        parser = cssm_parser.CSSMJSONParser(old_list)
+        parser.cssm_dataframe()
+
+        new_list = copy.deepcopy(old_list)
+        new_licenses = new_list[0]['roles'][1]['licenses']
+        new_licenses[2]['inUse'] = 20
+        new_licenses.reverse()
+
+        expected = cssm_parser.CSSMJSONParser(copy.deepcopy(new_list)).cssm_dataframe()
+        result = parser.refresh(new_list).cssm_dataframe()
+
+        pd.testing.assert_frame_equal(expected, result)
+        self.assertEqual([20, 20, 250, 250, 250, 250, 10, 0], list(result['inUse']))
+
+    def test_refresh_keeps_new_detail_fields(self):
+        parser = cssm_parser.CSSMJSONParser(small_account_list())
+        parser.cssm_dataframe()
+
+        new_list = small_account_list()
+        new_list[0]['roles'][1]['licenses'][0]['licenseDetails'][0]['newField'] = 'new'
+
+        expected = cssm_parser.CSSMJSONParser(copy.deepcopy(new_list)).cssm_dataframe()
+        result = parser.refresh(new_list).cssm_dataframe()
+
+        self.assertIn('newField', result.columns)
+        self.assertEqual(len(parser.cssm_dataframe().columns) + 1, len(result.columns))
+        pd.testing.assert_frame_equal(expected, result)
+
+    def test_refreshed_parser_does_not_keep_the_json(self):
+        expected = cssm_parser.CSSMJSONParser(small_account_list()).cssm_dataframe()
+
+        first = cssm_parser.CSSMJSONParser().refresh(small_account_list())
+        second = first.refresh(small_account_list())
+
+        for refreshed in (first, second):
+            self.assertFalse(refreshed.json_to_parse)
+            pd.testing.assert_frame_equal(expected, refreshed.cssm_dataframe())
+        self.assertEqual(first.license_fingerprints(), second.license_fingerprints())
+
+    def test_parsing_leaves_json_untouched(self):
+        the_list = small_account_list()
+        df = cssm_parser.CSSMJSONParser(the_list).cssm_dataframe()
+
+        self.assertEqual(small_account_list(), the_list)
+        self.assertEqual(4, len(df))
+
+    def test_shared_dataframe_is_read_only(self):
+        df = cssm_parser.CSSMJSONParser(small_account_list()).cssm_dataframe()
+
+        with self.assertRaises(ValueError):
+            df.iloc[0, df.columns.get_loc('inUse')] = 0
+
+    def test_freeze_falls_back_on_unknown_internals(self):
+        not_a_dataframe = object()
+
+        self.assertIs(not_a_dataframe, cssm_parser.freeze_dataframe(not_a_dataframe))
+
+    def test_snapshot_round_trip(self):
+        parser = cssm_parser.CSSMJSONParser(small_account_list())
+        expected = parser.cssm_dataframe()
+
+        with tempfile.TemporaryDirectory() as snapshot_dir:
+            path = os.path.join(snapshot_dir, 'snapshot.arrow')
+            parser.save_snapshot(path)
+            loaded = cssm_parser.CSSMJSONParser.load_snapshot(path)
+
+            pd.testing.assert_frame_equal(expected, loaded.cssm_dataframe())
+            self.assertEqual(parser.license_fingerprints(), loaded.license_fingerprints())
+
+    def test_threads_saving_one_snapshot(self):
+        parser = cssm_parser.CSSMJSONParser(small_account_list())
+        expected = parser.cssm_dataframe()
+        parser.license_fingerprints()
+
+        with tempfile.TemporaryDirectory() as snapshot_dir:
+            path = os.path.join(snapshot_dir, 'snapshot.arrow')
+            threads = [threading.Thread(target=parser.save_snapshot, args=(path,)) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            self.assertEqual(['snapshot.arrow'], os.listdir(snapshot_dir))
+            pd.testing.assert_frame_equal(expected, cssm_parser.CSSMJSONParser.load_snapshot(path).cssm_dataframe())
+
+    def test_unique_dataframe_drops_double_attached_licenses(self):
+        the_list = small_account_list()
+        # the same virtual account attached a second time, the way the SmartAccountSDK appends it
+        appended_role = copy.deepcopy(the_list[0]['roles'][1])
+        appended_role['role'] = 'APPENDED VA USER'
+        the_list[0]['roles'].append(appended_role)
+
+        parser = cssm_parser.CSSMJSONParser(the_list)
+        expected = cssm_parser.CSSMJSONParser(small_account_list()).cssm_license()
+
+        self.assertEqual(6, len(parser.cssm_dataframe()))
+        self.assertEqual(3, len(parser.cssm_unique_dataframe()))
+        self.assertEqual(expected.cssm_license_shortage(), parser.cssm_license().cssm_license_shortage())
+
+    def test_full_account_rows_are_built_with_the_dataframe(self):
+        parser = cssm_parser.CSSMJSONParser(small_account_list())
+        expected = {'SA SME_AT&T': [0, 1], 'SA SME_ATT EE CUSTOMER C': [2],
+                    'Cisco Sales Enablement_Alex Daltrini (adaltrin)': [3]}
+
+        with tempfile.TemporaryDirectory() as snapshot_dir:
+            path = os.path.join(snapshot_dir, 'snapshot.arrow')
+            parser.save_snapshot(path)
+            parsers = [parser, cssm_parser.CSSMJSONParser.load_snapshot(path), parser.refresh(small_account_list()),
+                       cssm_parser.CSSMJSONParser().refresh(small_account_list())]
+
+            for the_parser in parsers:
+                full_account_rows = the_parser.cssm_full_account_rows()
+                self.assertEqual(expected, {full_account: list(rows) for full_account, rows in full_account_rows.items()})
+                self.assertFalse(full_account_rows['SA SME_AT&T'].flags.writeable)
+                # handed over to the CSSMLicense rather than built again
+                self.assertIs(full_account_rows, the_parser.cssm_license().full_account_rows())
+
+    def test_dataframe_has_compact_dtypes(self):
+        df = cssm_parser.CSSMJSONParser(small_account_list()).cssm_dataframe()
+
+        self.assertEqual('category', str(df['virtualAccount'].dtype))
+        self.assertEqual('category', str(df['license'].dtype))
+        self.assertEqual('int16', str(df['inUse'].dtype))
+        self.assertEqual('int8', str(df['quantity'].dtype))
+        self.assertEqual('bool', str(df['isPortable'].dtype))
+        self.assertEqual('object', str(df['subscriptionId'].dtype))
+
+    def test_dataframe_chunks_one_per_account(self):
+        parser = cssm_parser.CSSMJSONParser(iter(small_account_list()))
+        chunks = list(parser.cssm_dataframe_chunks())
+
+        self.assertEqual(2, len(chunks))
+        self.assertEqual(['SA SME'], list(chunks[0]['accountName'].unique()))
+        self.assertEqual(['Cisco Sales Enablement'], list(chunks[1]['accountName'].unique()))
+
+    def test_license_chunks_match_cssm_license(self):
+        expected = cssm_parser.CSSMJSONParser(small_account_list()).cssm_license()
+        result = cssm_parser.CSSMJSONParser(iter(small_account_list())).cssm_license_chunks()
+
+        self.assertEqual(expected.cssm_license_shortage(), result.cssm_license_shortage())
+        self.assertEqual(expected.cssm_license_usage_dict(), result.cssm_license_usage_dict())
+        self.assertEqual(expected.cssm_expired_licenses(), result.cssm_expired_licenses())
+
+    def test_import_does_not_load_pandas(self):
+        code = 'import sys, CSSMJSONParser; print("pandas" in sys.modules)'
+        webex_teams_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+        result = subprocess.check_output([sys.executable, '-c', code], cwd=webex_teams_dir)
+
+        self.assertEqual(b'False', result.strip())
+
     def test_misc_test(self):
         with open(file_name) as json_data:
             json_array = json.load(json_data)